@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections import deque
+
+from selenium.common.exceptions import WebDriverException
+
+from pool import LoginError, ScraperPool
+
+
+class AdaptiveLimiter(object):
+    """Limit of in-flight portal requests that follows the portal's health.
+
+    The limit grows by one request per limit's worth of fast successes, it's cut by
+    decrease_factor when the smoothed latency goes over target_latency and halved on errors.
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=8, target_latency=10.0,
+                 decrease_factor=0.9, smoothing=0.2, window=50):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.smoothing = smoothing
+        self.latency = None
+        self.in_flight = 0
+        self.outcomes = deque(maxlen=window)
+        self.condition = None
+
+    def _condition(self):
+        # created lazily so the limiter can be built outside the event loop
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    async def acquire(self):
+        condition = self._condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency=None, error=False):
+        condition = self._condition()
+        async with condition:
+            self.in_flight -= 1
+            if latency is not None:
+                self.record(latency, error)
+            condition.notify_all()
+
+    def record(self, latency, error):
+        self.outcomes.append(error)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        if error:
+            self.limit = max(self.minimum, self.limit / 2)
+        elif self.latency > self.target_latency:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def stats(self):
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'latency': self.latency or 0.0,
+            'error_rate': float(sum(self.outcomes)) / len(self.outcomes) if self.outcomes else 0.0,
+        }
+
+
+class AsyncScraper(object):
+    """asyncio front end of a ScraperPool.
+
+    async with AsyncScraper(size=4) as scraper:
+        availability, price, ok = await scraper.get_availability('ABC-1', timeout=30)
+
+    The adaptive limiter keeps fewer requests in flight while the portal is slow or failing.
+    A timeout covers the wait for a free slot and the scrape itself. The slot is held until
+    the worker really finishes, so abandoned calls don't add load behind the limiter's back.
+    """
+
+    def __init__(self, pool=None, size=None, limiter=None, timeout=None):
+        self.pool = pool or ScraperPool(size)
+        self.limiter = limiter or AdaptiveLimiter(maximum=self.pool.size)
+        self.timeout = timeout
+
+    async def get_availability(self, catalog_number, timeout=None, **kwargs):
+        return await self.call('get_availability', catalog_number, timeout=timeout, **kwargs)
+
+    async def get_tracking(self, order_number, timeout=None, **kwargs):
+        return await self.call('get_tracking', order_number, timeout=timeout, **kwargs)
+
+    async def get_confirmation(self, order_number, timeout=None, **kwargs):
+        return await self.call('get_confirmation', order_number, timeout=timeout, **kwargs)
+
+    async def call(self, method, *args, **kwargs):
+        timeout = kwargs.pop('timeout', None) or self.timeout
+        deadline = time.monotonic() + timeout if timeout else None
+        await asyncio.wait_for(self.limiter.acquire(), timeout)
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        done = loop.create_future()
+
+        def finished(job):
+            # runs in the pool's collector thread
+            loop.call_soon_threadsafe(self._finished, job, started, done)
+
+        try:
+            job = self.pool.submit(method, *args, **kwargs)
+            job.add_done_callback(finished)
+        except BaseException:
+            # no job will release the slot
+            await self.limiter.release()
+            raise
+        remaining = deadline - time.monotonic() if deadline else None
+        try:
+            # on timeout the job still runs to the end and releases its slot then
+            return await asyncio.wait_for(asyncio.shield(done), remaining)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # nobody awaits the result any more, _finished must not set it
+            done.cancel()
+            raise
+
+    def _finished(self, job, started, done):
+        if job.cancelled():
+            # dropped from the pool's queue, e.g. by close(), it never ran
+            asyncio.ensure_future(self.limiter.release())
+            done.cancel()
+            return
+        # only the portal and login failures say something about the portal's health,
+        # an empty result is also the answer for a missing PO
+        error = isinstance(job.exception(), (WebDriverException, LoginError))
+        asyncio.ensure_future(self.limiter.release(time.monotonic() - started, error))
+        if done.cancelled():
+            return
+        if job.exception() is not None:
+            done.set_exception(job.exception())
+        else:
+            done.set_result(job.result())
+
+    def stats(self):
+        stats = self.limiter.stats()
+        stats.update(('pool_%s' % key, value) for key, value in self.pool.stats().items())
+        return stats
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+def approximate_size(value):
+    """Rough memory footprint of the cached availability tuples"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(approximate_size(v) for v in value)
+    return size
+
+
+def valid_result(value):
+    """An (availability, price, ok) answer"""
+    return isinstance(value, (tuple, list)) and len(value) == 3 and isinstance(value[0], dict)
+
+
+class _Flight(object):
+    """One scrape in progress, shared by everybody asking for the same catalog number"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AvailabilityCache(object):
+    """TTL + LRU cache in front of get_availability.
+
+    Fresh entries are served for ttl seconds. For stale_ttl seconds more the old value is
+    served while one background scrape refreshes it, at most refresh_workers of them
+    run at once. Concurrent misses for the same catalog
+    number wait for a single scrape. fetch is anything with the get_availability signature,
+    e.g. ScraperPool.get_availability; a lone Scraper isn't thread safe, pass a lock for it.
+
+    cache = AvailabilityCache(scraper.get_availability, lock=threading.Lock())
+    availability, price, ok = cache.get('ABC-1')
+    """
+
+    def __init__(self, fetch, ttl=60, stale_ttl=300, max_bytes=16 * 1024 * 1024, lock=None, refresh_workers=4):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.fetch_lock = lock
+        self.lock = threading.Lock()
+        # catalog number -> (value, fetched timestamp, size)
+        self.entries = OrderedDict()
+        self.flights = {}
+        self.refresher = ThreadPoolExecutor(max_workers=refresh_workers)
+        self.size = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def get(self, catalog_number):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(catalog_number)
+            if entry is not None:
+                value, fetched, _ = entry
+                age = now - fetched
+                if age < self.ttl:
+                    self.hits += 1
+                    self.entries.move_to_end(catalog_number)
+                    return value
+                if age < self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    self.entries.move_to_end(catalog_number)
+                    if catalog_number not in self.flights:
+                        self._refresh(catalog_number)
+                    return value
+            flight = self.flights.get(catalog_number)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = self.flights[catalog_number] = _Flight()
+                leader = True
+        if leader:
+            self._scrape(catalog_number, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _refresh(self, catalog_number):
+        """Scrape in the background, must be called holding the lock"""
+        flight = self.flights[catalog_number] = _Flight()
+        try:
+            self.refresher.submit(self._scrape, catalog_number, flight)
+        except RuntimeError:
+            # closed, the stale value is served until it expires
+            del self.flights[catalog_number]
+            flight.done.set()
+        else:
+            self.refreshes += 1
+
+    def _scrape(self, catalog_number, flight):
+        try:
+            try:
+                if self.fetch_lock is not None:
+                    with self.fetch_lock:
+                        flight.result = self.fetch(catalog_number)
+                else:
+                    flight.result = self.fetch(catalog_number)
+            except Exception as e:
+                log.exception("availability refresh failed: %s", catalog_number)
+                flight.error = e
+            if flight.error is None and not valid_result(flight.result):
+                flight.error = ValueError("unexpected availability result for %s: %r"
+                                          % (catalog_number, flight.result))
+                log.error("%s", flight.error)
+            with self.lock:
+                self.flights.pop(catalog_number, None)
+                # only the successful answers are cached
+                if flight.error is None and flight.result[2]:
+                    self._store(catalog_number, flight.result)
+                else:
+                    self.errors += 1
+        finally:
+            # the waiters must never hang, whatever happened above
+            flight.done.set()
+
+    def _store(self, catalog_number, value):
+        old = self.entries.pop(catalog_number, None)
+        if old is not None:
+            self.size -= old[2]
+        size = approximate_size(value)
+        self.entries[catalog_number] = (value, time.time(), size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def invalidate(self, catalog_number=None):
+        with self.lock:
+            if catalog_number is None:
+                self.entries.clear()
+                self.size = 0
+            elif catalog_number in self.entries:
+                self.size -= self.entries.pop(catalog_number)[2]
+
+    def close(self):
+        """Stop refreshing, the refreshes already running still finish"""
+        self.refresher.shutdown(wait=False)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            ages = [now - fetched for _, fetched, _ in self.entries.values()]
+            requests = self.hits + self.stale_hits + self.misses + self.coalesced
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'refreshes': self.refreshes,
+                'errors': self.errors,
+                'hit_rate': float(self.hits + self.stale_hits) / requests if requests else 0.0,
+                'mean_age': sum(ages) / len(ages) if ages else 0.0,
+                'max_age': max(ages) if ages else 0.0,
+            }
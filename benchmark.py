@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Offline benchmark of the scraper against the local fake portal.
+
+python benchmark.py --runs 20 --rows 40 --latency 0.02
+python benchmark.py --operations get_tracking get_confirmation --json bench.json
+python benchmark.py --calendar 100000
+
+Reports p50/p95 latency, WebDriver commands per call and throughput of every operation,
+so a slower scraper.py shows up before it hits the real portal.
+"""
+import argparse
+import json
+import time
+
+import fake_portal
+from scraper import BusinessCalendar, Scraper
+from utils.dates import next_business_days
+
+OPERATIONS = ('login', 'get_availability', 'get_tracking', 'get_confirmation', 'place_order')
+
+ORDER_DETAILS = {
+    'order_id': 'BENCH-1',
+    'first_name': 'John',
+    'last_name': 'Doe',
+    'company': 'ACME',
+    'address': {
+        'address_1': '1 Main St',
+        'city': 'Los Angeles',
+        'postal_code': '90001',
+        'country': 'US',
+        'state': 'CA',
+    },
+    'items': [
+        {'catalog_number': 'SKU-1', 'qty': 2, 'weight': 1.5},
+        {'catalog_number': 'SKU-2', 'qty': 1, 'weight': 20.0},
+    ],
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def bench_scraper_class(domain):
+    class BenchScraper(Scraper):
+        DOMAIN = domain
+        USERNAME = 'bench'
+        PASSWORD = 'bench'
+        SESSION_FILE = None
+        CATALOG_CACHE_PATH = ':memory:'
+        ORDER_STATUS_PATH = ':memory:'
+        ORDER_SNAPSHOT_TTL = 0
+        # the WebDriver commands per call are read from the instrumentation counters
+        INSTRUMENT = True
+    return BenchScraper
+
+
+def reset_state(scraper, operation):
+    """Start every run cold, the caches would hide the portal round trips"""
+    scraper._catalog_cache = None
+    scraper._order_snapshots = None
+    if operation == 'login':
+        scraper.browser.delete_all_cookies()
+        scraper.logged_in = False
+    elif not scraper.logged_in:
+        scraper.login()
+
+
+def call(scraper, operation, run):
+    if operation == 'login':
+        return scraper.login()
+    if operation == 'get_availability':
+        return scraper.get_availability('SKU-%s' % (run + 1))[2]
+    if operation in ('get_tracking', 'get_confirmation'):
+        po_number = 'PO%05d' % (run % 20 + 1)
+        results = getattr(scraper, operation)(po_number)
+        # the fake portal's products carry the PO, a result of another order is an error
+        if operation == 'get_tracking':
+            return bool(results) and all(item['item_id'].startswith(po_number) for item in results)
+        return bool(results) and results[0]['confirm_number'] == fake_portal.PortalData.order_number(po_number)
+    if operation == 'place_order':
+        return scraper.place_order(json.loads(json.dumps(ORDER_DETAILS)), submit=False)[0]
+    raise ValueError(operation)
+
+
+def commands_sent(scraper):
+    return sum(scraper.instrumentation.command_calls.values())
+
+
+def benchmark(scraper, operations, runs):
+    report = {}
+    for operation in operations:
+        latencies, commands, errors = [], [], 0
+        started = time.time()
+        for run in range(runs):
+            reset_state(scraper, operation)
+            commands_before = commands_sent(scraper)
+            call_started = time.time()
+            try:
+                ok = call(scraper, operation, run)
+            except Exception:
+                scraper.log.exception("benchmark %s failed", operation)
+                ok = False
+            latencies.append(time.time() - call_started)
+            commands.append(commands_sent(scraper) - commands_before)
+            errors += not ok
+        elapsed = time.time() - started
+        report[operation] = {
+            'runs': runs,
+            'errors': errors,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'commands': float(sum(commands)) / runs,
+            'throughput': runs / elapsed if elapsed else 0.0,
+        }
+    return report
+
+
+def bench_calendar(rows):
+    """Lead date of availability rows: next_business_days() per row vs the precomputed calendar"""
+    lead_days = [row % 30 + 1 for row in range(rows)]
+    started = time.time()
+    expected = [next_business_days(days)[-1][0] for days in lead_days]
+    per_row = time.time() - started
+    calendar = BusinessCalendar()
+    started = time.time()
+    calculated = [calendar.lead_date(days) for days in lead_days]
+    precomputed = time.time() - started
+    assert calculated == expected, "calendar lead dates differ from next_business_days"
+    print('%d rows: next_business_days %.3fs, calendar %.3fs (%.0fx)'
+          % (rows, per_row, precomputed, per_row / precomputed if precomputed else 0))
+
+
+def print_report(report):
+    print('%-18s %6s %6s %9s %9s %10s %10s' % ('operation', 'runs', 'errors', 'p50 ms', 'p95 ms',
+                                               'commands', 'ops/s'))
+    for operation, result in report.items():
+        print('%-18s %6d %6d %9.1f %9.1f %10.1f %10.2f' % (
+            operation, result['runs'], result['errors'], result['p50'] * 1000, result['p95'] * 1000,
+            result['commands'], result['throughput']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=10, help='item rows per portal page')
+    parser.add_argument('--warehouses', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every portal request')
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--calendar', type=int, metavar='ROWS',
+                        help='only compare the lead date calculation over this many rows')
+    args = parser.parse_args()
+    if args.calendar:
+        return bench_calendar(args.calendar)
+
+    server, url = fake_portal.serve(rows=args.rows, warehouses=args.warehouses, latency=args.latency)
+    scraper = bench_scraper_class(url)()
+    try:
+        report = benchmark(scraper, args.operations, args.runs)
+    finally:
+        scraper.quit_browser()
+        server.shutdown()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class CatalogNumberCache(object):
+    """Persistent map of the portal's new product ids to our catalog numbers.
+    Entries expire after ttl seconds, the least recently used ones are evicted above max_size.
+    The last use is written at most once per touch_interval, so hits are plain reads.
+    Database errors are logged and treated as misses, the cache never breaks a scrape."""
+
+    def __init__(self, path, ttl=30 * 24 * 3600, max_size=50000, touch_interval=3600, timeout=10, logger=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.touch_interval = touch_interval
+        self.log = logger or log
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        # other processes share the file, wait for their writes instead of failing
+        self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS catalog_numbers ('
+                        'product_id TEXT PRIMARY KEY, catalog_number TEXT NOT NULL, '
+                        'updated REAL NOT NULL, used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS catalog_numbers_used ON catalog_numbers (used)')
+        self.db.commit()
+
+    @classmethod
+    def open(cls, path, logger=None, **kwargs):
+        """The cache in the file at path, in memory if the file can't be used"""
+        try:
+            return cls(path, logger=logger, **kwargs)
+        except sqlite3.Error:
+            (logger or log).exception("failed to open catalog number cache %s, using memory", path)
+            return cls(':memory:', logger=logger, **kwargs)
+
+    def get(self, product_id):
+        now = time.time()
+        with self.lock:
+            try:
+                row = self.db.execute('SELECT catalog_number, updated, used FROM catalog_numbers '
+                                      'WHERE product_id = ?', (product_id,)).fetchone()
+                if row is None or now - row[1] > self.ttl:
+                    self.misses += 1
+                    return None
+                if now - row[2] > self.touch_interval:
+                    self.db.execute('UPDATE catalog_numbers SET used = ? WHERE product_id = ?', (now, product_id))
+                    self.db.commit()
+            except sqlite3.Error:
+                self.failed("read")
+                return None
+            self.hits += 1
+            return row[0]
+
+    def set(self, product_id, catalog_number):
+        now = time.time()
+        with self.lock:
+            try:
+                self.db.execute('INSERT OR REPLACE INTO catalog_numbers VALUES (?, ?, ?, ?)',
+                                (product_id, catalog_number, now, now))
+                self.db.execute('DELETE FROM catalog_numbers WHERE product_id IN ('
+                                'SELECT product_id FROM catalog_numbers ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                                (self.max_size,))
+                self.db.commit()
+            except sqlite3.Error:
+                self.failed("write")
+
+    def failed(self, operation):
+        # must be called holding the lock
+        self.errors += 1
+        self.log.exception("catalog number cache %s failed", operation)
+        try:
+            self.db.rollback()
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        with self.lock:
+            try:
+                size = self.db.execute('SELECT COUNT(*) FROM catalog_numbers').fetchone()[0]
+            except sqlite3.Error:
+                size = None
+        return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors, 'size': size}
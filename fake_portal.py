@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the SAP ISA B2B portal, for benchmarks and offline runs.
+
+python fake_portal.py --port 8765 --rows 40 --latency 0.05
+
+It serves synthetic versions of the pages the scraper uses: the login form and the
+frameset, helpvalues.do, genericsearch.do, orderstatusdetail.jsp with its ship-to popup
+and the order entry form with the product popup. Any catalog number is known,
+its new product id is 'N' + catalog number.
+
+Like the real portal every login gets its own session, the order detail page shows the
+order last selected in that session and the search results select it with an onclick
+script. --plain-links serves plain document status links instead, for the HTTP mode.
+"""
+import itertools
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+SESSION_COOKIE = 'JSESSIONID'
+
+PAGE = '<html><head><title>%s</title></head><body class="%s">%s</body></html>'
+
+LOGIN_FORM = '''
+<form method="post" action="/b2b_altra/b2b/login.do">
+  <input name="UserId"><input type="password" name="nolog_password">
+  <input type="submit" name="login" value="Log on">
+</form>'''
+
+SEARCH_LINK = '<a href="#" onclick="document.forms[0].submit(); return false;">Search</a>'
+
+
+class PortalData(object):
+    """Generated portal content, sizes are configurable"""
+
+    def __init__(self, rows=10, warehouses=3, orders=20, latency=0.0, plain_links=False):
+        self.rows = rows
+        self.warehouses = warehouses
+        self.orders = orders
+        self.latency = latency
+        self.plain_links = plain_links
+        self.requests = 0
+        self.lock = threading.Lock()
+        # session id -> PO number of the selected order, None before any
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+
+    def locations(self):
+        return ['WH%02d' % i for i in range(1, self.warehouses + 1)]
+
+    @staticmethod
+    def ids(product):
+        """(new product id, old catalog number) of a searched product"""
+        if product.startswith('N'):
+            return product, product[1:]
+        return 'N' + product, product
+
+    def po_numbers(self):
+        return ['PO%05d' % i for i in range(1, self.orders + 1)]
+
+    @staticmethod
+    def order_number(po_number):
+        return str(4500000000 + int(po_number[2:]))
+
+
+class Handler(BaseHTTPRequestHandler):
+    data = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.route(parse_qs(urlparse(self.path).query, keep_blank_values=True))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        fields = parse_qs(self.rfile.read(length).decode('utf-8'), keep_blank_values=True)
+        fields.update(parse_qs(urlparse(self.path).query, keep_blank_values=True))
+        self.route(fields)
+
+    def route(self, fields):
+        with self.data.lock:
+            self.data.requests += 1
+        if self.data.latency:
+            time.sleep(self.data.latency)
+        path = urlparse(self.path).path
+        fields = dict((k, v[-1]) for k, v in fields.items())
+        if path == '/favicon.ico':
+            return self.send_page('', status=404)
+        if path.endswith('/init.do'):
+            return self.send_page(PAGE % ('Login', '', LOGIN_FORM))
+        if path.endswith('/login.do'):
+            with self.data.lock:
+                session = 'fakeportal%s' % next(self.data.session_ids)
+                self.data.sessions[session] = None
+            return self.redirect('/b2b_altra/b2b/start.do', session=session)
+        if self.session() is None:
+            return self.send_page(PAGE % ('Login', '', LOGIN_FORM))
+        pages = {
+            'start.do': self.start, 'top.do': self.top, 'work.do': self.work, 'header.do': self.header,
+            'welcome.do': self.welcome, 'order.do': self.order, 'productpopup.do': self.product_popup,
+            'simulate.do': self.simulate, 'helpvalues.do': self.help_values,
+            'genericsearch.do': self.generic_search, 'documentstatus.do': self.document_status,
+            'orderstatusdetail.jsp': self.order_detail, 'shipto.jsp': self.ship_to,
+        }
+        page = pages.get(path.rsplit('/', 1)[-1])
+        if page is None:
+            return self.send_page(PAGE % ('Not found', '', ''), status=404)
+        self.send_page(page(fields))
+
+    def send_page(self, body, status=200):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def session(self):
+        """Id of the request's session, None if it's missing or unknown"""
+        for cookie in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == SESSION_COOKIE and value in self.data.sessions:
+                return value
+        return None
+
+    def redirect(self, location, session=None):
+        self.send_response(302)
+        self.send_header('Location', location)
+        if session:
+            self.send_header('Set-Cookie', '%s=%s; Path=/' % (SESSION_COOKIE, session))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # frames
+    def start(self, fields):
+        return '<html><frameset rows="*"><frame name="isaTop" src="/b2b_altra/b2b/top.do"></frameset></html>'
+
+    def top(self, fields):
+        return ('<html><frameset rows="60,*"><frame name="header" src="/b2b_altra/b2b/header.do">'
+                '<frame name="work_history" src="/b2b_altra/b2b/work.do"></frameset></html>')
+
+    def work(self, fields):
+        return ('<html><frameset cols="*"><frame name="form_input" src="/b2b_altra/b2b/welcome.do">'
+                '</frameset></html>')
+
+    def header(self, fields):
+        return PAGE % ('Header', '', '<a href="/b2b_altra/b2b/init.do">Log off</a>')
+
+    def welcome(self, fields):
+        return PAGE % ('Welcome', '', '<a href="#" onclick="location.href=\'/b2b_altra/b2b/order.do\'; '
+                                      '/* create_order */ return false;">Create order</a>')
+
+    # order entry
+    def order(self, fields):
+        lines = int(fields.get('lines') or 0) + int(fields.get('newposcount') or 0)
+        options = ''.join('<option value="%s">%s</option>' % (n, n) for n in (1, 5, 10, 15, 25, 50))
+        rows = ''.join(
+            '<tr><td><input name="product[%(i)s]"><input name="ZZBISMT[%(i)s]"><input name="MAKTG[%(i)s]">'
+            '<input name="quantity[%(i)s]"></td></tr>' % {'i': i} for i in range(1, lines + 1))
+        body = '''
+<form name="order_positions" method="post" action="/b2b_altra/b2b/order.do">
+  <input type="hidden" name="lines" value="%(lines)s">
+  <select id="newposcount" name="newposcount">%(options)s</select>
+  <a href="#" onclick="document.forms['order_positions'].submit(); /* submit_refresh */ return false;">Refresh</a>
+  <a href="#" onclick="window.open('/b2b_altra/b2b/productpopup.do', 'products'); /* getHelpValuesPopupProduct */
+     return false;">Products</a>
+  <table class="itemlist">%(rows)s</table>
+  <a href="#" onclick="document.getElementById('shipto').style.display='block'; /* newShipTo */
+     return false;">New ship-to</a>
+  <div id="shipto" style="display: none">
+    <input name="lastName"><input name="firstName"><input name="street"><input name="city">
+    <input name="postalCode"><input name="telephoneNumber"><input name="faxNumber">
+    <select name="country"><option value="US">United States</option><option value="CA">Canada</option>
+      <option value="DE">Germany</option></select>
+    <select name="region"><option value="CA">California</option><option value="NY">New York</option>
+      <option value="ON">Ontario</option></select>
+    <a href="#" onclick="document.getElementById('shipto').style.display='none'; /* saveForm */
+       return false;">Save</a>
+  </div>
+  <input name="poNumber">
+  <select id="zFreightForwarder" name="zFreightForwarder"><option value="FDX003">FedEx</option>
+    <option value="UPGF">UPS Freight</option></select>
+  <select id="incoterms1" name="incoterms1"><option value="TPC">Third party</option></select>
+  <input name="incoterms2">
+  <a href="javascript:toggleText(&quot;text_1&quot;)"
+     onclick="document.getElementById('text_1').style.display='block'; return false;">Notes</a>
+  <div id="text_1" style="display: none"><textarea name="textZ004"></textarea></div>
+  <a href="#" onclick="var f = document.forms['order_positions']; f.action='/b2b_altra/b2b/simulate.do';
+     f.submit(); /* submit_simulate */ return false;">Simulate</a>
+</form>''' % {'lines': lines, 'options': options, 'rows': rows}
+        return PAGE % ('Order', '', body)
+
+    def product_popup(self, fields):
+        product = fields.get('product', '')
+        rows = ''
+        if product:
+            new_id, old = self.data.ids(product)
+            for location in self.data.locations():
+                href = ("javascript:selectProduct('%s','%s','Product %s','0','Altra','%s','%s','US','100','EA',"
+                        "'12.50','15.00','3','Altra','Street 1','City','CA','90001')"
+                        % (new_id, old, old, location, location))
+                rows += '<tr><td><a href="%s">%s</a></td></tr>' % (escape(href), location)
+        body = ('<form method="get" action="/b2b_altra/b2b/productpopup.do"><input name="product" value="%s">'
+                '%s</form><table class="itemlist"><tr><th>Warehouse</th></tr>%s</table>'
+                % (escape(product), SEARCH_LINK, rows))
+        return PAGE % ('Products', '', body)
+
+    def simulate(self, fields):
+        address = ' ... '.join(fields.get(name, '') for name in ('lastName', 'firstName', 'street', 'city'))
+        rows = ''
+        for i in range(1, int(fields.get('lines') or 0) + 1):
+            product = fields.get('product[%s]' % i)
+            if product:
+                rows += ('<tr><td class="product">%s</td><td class="qty">%s EA</td></tr>'
+                         % (escape(product), escape(fields.get('quantity[%s]' % i, '0'))))
+        body = ('<div class="header-itemdefault"><table><tr><td class="value">%s</td></tr></table></div>'
+                '<table class="itemlist">%s</table><input type="checkbox" name="termsAccepted">'
+                % (escape(address), rows))
+        return PAGE % ('Simulation', '', body)
+
+    # read-only pages
+    def help_values(self, fields):
+        product = fields.get('product[1]') or fields.get('MAKTG[1]') or ''
+        table = ''
+        if product:
+            new_id, old = self.data.ids(product)
+            rows = ''
+            for n in range(self.data.rows):
+                location = self.data.locations()[n % self.data.warehouses]
+                cells = [new_id, old, 'Product ' + old, '', '', '', str(n % 4 * 10), 'EA', '$12.50', '',
+                         str(n % 5), '', '', location]
+                rows += '<tr>%s</tr>' % ''.join('<td><a href="#">%s</a></td>' % escape(c) for c in cells)
+            table = '<table class="itemlist"><tr>%s</tr>%s</table>' % ('<th>col</th>' * 14, rows)
+        body = ('<form method="get" action="/b2b_altra/base/helpvalues.do">'
+                '<input type="hidden" name="helpValuesSearch" value="Product">'
+                '<input name="product[1]" value="%s"><input name="MAKTG[1]" value="%s">%s</form>%s'
+                % (escape(fields.get('product[1]', '')), escape(fields.get('MAKTG[1]', '')), SEARCH_LINK, table))
+        return PAGE % ('Help values', '', body)
+
+    def generic_search(self, fields):
+        po_filter = fields.get('rc_po_number_uc', '')
+        rows = ''
+        for n, po_number in enumerate(self.data.po_numbers(), 1):
+            if po_filter and po_filter != po_number:
+                continue
+            url = '/b2b_altra/b2b/documentstatus.do?po=%s' % po_number
+            if self.data.plain_links:
+                link = '<a href="%s">' % url
+            else:
+                link = '<a href="#" onclick="location.href=\'%s\'; return false;">' % url
+            rows += ('<tr><td>%s%s</a></td><td>%s</td><td>%s</td></tr>'
+                     % (link, self.data.order_number(po_number), po_number, 'Open' if n % 2 else 'Completed'))
+        body = ('<table summary="Search Results"><tr><th>Order</th><th>Purchase Order No.</th><th>Status</th></tr>'
+                '%s</table>' % rows)
+        return PAGE % ('Search', '', body)
+
+    def document_status(self, fields):
+        po_number = fields.get('po', '')
+        if po_number not in self.data.po_numbers():
+            return PAGE % ('Order', '', 'Order not found')
+        with self.data.lock:
+            self.data.sessions[self.session()] = po_number
+        return PAGE % ('Order', '', 'Order %s selected' % escape(po_number))
+
+    def order_detail(self, fields):
+        po_number = self.data.sessions.get(self.session())
+        if po_number is None:
+            return PAGE % ('Order status', '', 'No order selected')
+        rows = ''
+        for n in range(1, self.data.rows + 1):
+            rows += ('<tr id="row_%(n)s"><td class="product">N%(po)s-%(n)s</td>'
+                     '<td class="date-on">01/%(d)02d/2030</td><td class="qty">%(n)s EA</td></tr>'
+                     '<tr id="rowdetail_%(n)s"><td><a href="#" onclick="window.open(\'https://wwwapps.ups.com'
+                     '/WebTracking/track?&amp;tracknumbers=1Z%(po)s%(n)04d\')">'
+                     '<img alt="External Order Tracking" src="/track.gif"></a></td></tr>'
+                     % {'n': n, 'd': n % 28 + 1, 'po': po_number})
+        body = '''
+<h1>Order: %s</h1>
+<p>Purchase Order No.: %s</p>
+<a href="#" onclick="window.open('/b2b_altra/ecombase/documentstatus/shipto.jsp', 'shipto'); /* showShipTo */
+   return false;">Ship-to</a>
+<table class="itemlist">%s</table>
+<table><tr><td>Shipping Costs:</td><td>$25.00</td></tr></table>'''
+        return PAGE % ('Order status', '', body % (self.data.order_number(po_number), po_number, rows))
+
+    def ship_to(self, fields):
+        body = '''
+<input name="lastName" value="ACME"><input name="firstName" value="John Doe">
+<input name="street" value="1 Main St"><input name="postalCode" value="90001"><input name="city" value="Los Angeles">
+<select name="country"><option value="US" selected>United States</option></select>
+<select name="region"><option value="CA" selected>California</option></select>'''
+        return PAGE % ('Ship-to', '', body)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(host='127.0.0.1', port=0, **options):
+    """Start the portal in a background thread. Return (server, base url)."""
+    handler = type('PortalHandler', (Handler,), {'data': PortalData(**options)})
+    server = ThreadingServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name='fake-portal')
+    thread.daemon = True
+    thread.start()
+    return server, 'http://%s:%s' % server.server_address
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rows', type=int, default=10, help='item rows per page')
+    parser.add_argument('--warehouses', type=int, default=3)
+    parser.add_argument('--orders', type=int, default=20, help='orders in the search results')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--plain-links', action='store_true', help='search results link the order directly')
+    args = parser.parse_args()
+    server, url = serve(args.host, args.port, rows=args.rows, warehouses=args.warehouses,
+                        orders=args.orders, latency=args.latency, plain_links=args.plain_links)
+    print('fake portal on %s' % url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Text of lxml elements read the way Selenium's WebElement shows it, for the pages parsed from one
+page_source snapshot. Kept apart from scraper.py so it imports without the spider base classes."""
+import re
+
+from selenium.common.exceptions import NoSuchElementException
+
+
+# elements whose text WebDriver never returns
+SKIPPED_TAGS = frozenset(['head', 'title', 'script', 'style', 'noscript', 'template'])
+BLOCK_TAGS = frozenset(['address', 'article', 'aside', 'blockquote', 'caption', 'center', 'dd', 'div', 'dl',
+                        'dt', 'fieldset', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                        'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'tbody',
+                        'tfoot', 'thead', 'tr', 'ul'])
+HIDDEN_STYLE = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden', re.I)
+COLLAPSED_SPACE = re.compile(r'[ \t\n\r\f]+')
+
+
+def element_hidden(elem):
+    """Hidden by its tag, the hidden attribute or an inline style. Stylesheets aren't applied."""
+    return (elem.tag in SKIPPED_TAGS or elem.get('hidden') is not None
+            or HIDDEN_STYLE.search(elem.get('style') or '') is not None)
+
+
+def _visible_text(elem, lines):
+    if not isinstance(elem.tag, str) or element_hidden(elem):
+        # comments and hidden elements, their tail is still shown
+        return
+    block = elem.tag in BLOCK_TAGS
+    if block and lines[-1].strip():
+        lines.append('')
+    elif elem.tag == 'br':
+        lines.append('')
+    lines[-1] += elem.text or ''
+    for child in elem:
+        _visible_text(child, lines)
+        lines[-1] += child.tail or ''
+    if block and lines[-1].strip():
+        lines.append('')
+    elif elem.tag in ('td', 'th') and lines[-1].strip():
+        lines[-1] += ' '
+
+
+def element_text(elem):
+    """Text of an lxml element the way WebElement.text shows it: scripts, styles and inline
+    hidden elements are skipped, <br> and block elements break the lines, other whitespace
+    is collapsed and &nbsp; becomes a plain space"""
+    lines = ['']
+    _visible_text(elem, lines)
+    lines = [COLLAPSED_SPACE.sub(' ', line).strip(' ') for line in lines]
+    return '\n'.join(lines).strip(' \n').replace(u'\xa0', ' ')
+
+
+def xpath_text(elem, xpath):
+    """Text of the first element matching xpath. Raise NoSuchElementException like WebDriver does."""
+    found = elem.xpath(xpath)
+    if not found:
+        raise NoSuchElementException("Unable to locate element: %s" % xpath)
+    return element_text(found[0])
+
+
+def xpath_attr(elem, xpath, attr):
+    found = elem.xpath(xpath)
+    if not found:
+        raise NoSuchElementException("Unable to locate element: %s" % xpath)
+    return found[0].get(attr)
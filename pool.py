@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+import itertools
+import logging
+import multiprocessing
+import pickle
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+
+from selenium.common.exceptions import WebDriverException
+
+from scraper import Scraper
+
+log = logging.getLogger(__name__)
+
+# seconds before restarting a scraper that keeps failing, doubled on every failure
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+
+
+def _backoff(failures):
+    return min(RESTART_DELAY * 2 ** (failures - 1), MAX_RESTART_DELAY) if failures else 0
+
+
+class LoginError(Exception):
+    """The worker's scraper couldn't log in to the portal, the job wasn't run"""
+
+
+def _default_start_method():
+    # forking the process running the collector thread can deadlock the child on a held lock
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def _start_scraper(index, scraper_class, scraper_kwargs):
+    scraper = scraper_class(**scraper_kwargs)
+    # a saved session is shared by the processes using the same file,
+    # every worker needs a portal session of its own
+    scraper.session_key = 'pool%s' % index
+    if not scraper.login():
+        log.warning("pool worker failed to login, retrying before the first job")
+    return scraper
+
+
+def _stop_scraper(scraper):
+    try:
+        scraper.quit_browser()
+    except Exception:
+        log.exception("failed to quit browser")
+
+
+def _portable_error(error):
+    try:
+        pickle.dumps(error)
+    except Exception:
+        return RuntimeError(repr(error))
+    return error
+
+
+def _worker(index, scraper_class, scraper_kwargs, tasks, results):
+    scraper = _start_scraper(index, scraper_class, scraper_kwargs)
+    failures = 0 if scraper.logged_in else 1
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, method, args, kwargs = task
+        result, error, recycle = None, None, False
+        try:
+            # the scraper methods answer a failed login like an empty result, tell it apart
+            if not scraper.logged_in and not scraper.login():
+                raise LoginError("pool worker %s failed to login" % index)
+            result = getattr(scraper, method)(*args, **kwargs)
+        except WebDriverException as e:
+            log.exception("pool job %s failed, recycling the browser", method)
+            error, recycle = e, True
+        except Exception as e:
+            log.exception("pool job %s failed", method)
+            error = e
+        results.put(('done', job_id, (result, _portable_error(error) if error else None)))
+        # quit_browser() drops the login, e.g. after a failed place_order
+        if recycle or not scraper.logged_in:
+            _stop_scraper(scraper)
+            time.sleep(_backoff(failures))
+            scraper = _start_scraper(index, scraper_class, scraper_kwargs)
+            failures = 0 if scraper.logged_in else failures + 1
+    _stop_scraper(scraper)
+
+
+class ScraperPool(object):
+    """Keep a number of logged in Scraper processes and dispatch jobs to the idle ones.
+
+    pool = ScraperPool(4)
+    future = pool.submit('get_tracking', '12345')
+    availability, price, ok = pool.get_availability('ABC-1', timeout=60)
+
+    Every worker has its own task queue and gets a job only when it's idle, so the pool
+    always knows which job a worker runs and fails exactly that one if the worker dies.
+    The workers are started with start_method, forkserver or spawn by default, so
+    scraper_class and its kwargs must be picklable.
+    """
+
+    def __init__(self, size=None, scraper_class=Scraper, start_method=None, **scraper_kwargs):
+        self.size = size or multiprocessing.cpu_count()
+        self.scraper_class = scraper_class
+        self.scraper_kwargs = scraper_kwargs
+        self.context = multiprocessing.get_context(start_method or _default_start_method())
+        self.results = self.context.Queue()
+        self.queue = deque()
+        self.futures = {}
+        # worker index -> job id
+        self.running = {}
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count()
+        self.closed = False
+        self.completed = 0
+        # deaths in a row and the time a dead worker is restarted at, per worker index
+        self.failures = [0] * self.size
+        self.restart_at = [None] * self.size
+        self.tasks = [None] * self.size
+        self.workers = [self._spawn(index) for index in range(self.size)]
+        self.collector = threading.Thread(target=self._collect, name='scraper-pool-collector')
+        self.collector.daemon = True
+        self.collector.start()
+
+    def _spawn(self, index):
+        # a fresh queue, the old one may hold the dead worker's job
+        self.tasks[index] = self.context.Queue()
+        worker = self.context.Process(
+            target=_worker, name='scraper-pool-%s' % index,
+            args=(index, self.scraper_class, self.scraper_kwargs, self.tasks[index], self.results))
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def _dispatch(self):
+        """Hand the queued jobs to the idle workers, must be called holding the lock"""
+        idle = [index for index in range(self.size)
+                if index not in self.running and self.restart_at[index] is None]
+        while idle and self.queue:
+            job_id, method, args, kwargs = task = self.queue.popleft()
+            future = self.futures.get(job_id)
+            # cancelled while queued
+            if future is None or not future.set_running_or_notify_cancel():
+                self.futures.pop(job_id, None)
+                continue
+            index = idle.pop(0)
+            self.running[index] = job_id
+            self.tasks[index].put(task)
+
+    def _collect(self):
+        while True:
+            try:
+                message = self.results.get(timeout=1)
+            except Exception:
+                message = None
+            if message is not None:
+                kind, job_id, payload = message
+                if kind == 'stop':
+                    break
+                with self.lock:
+                    future = self.futures.pop(job_id, None)
+                    for index in [k for k, v in self.running.items() if v == job_id]:
+                        del self.running[index]
+                        self.failures[index] = 0
+                    self.completed += 1
+                    self._dispatch()
+                if future is not None:
+                    result, error = payload
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+            if not self.closed:
+                self._replace_dead_workers()
+
+    def _replace_dead_workers(self):
+        for index, worker in enumerate(self.workers):
+            if self.restart_at[index] is not None:
+                if time.time() >= self.restart_at[index]:
+                    with self.lock:
+                        self.restart_at[index] = None
+                        self.workers[index] = self._spawn(index)
+                        self._dispatch()
+                continue
+            if worker.is_alive():
+                continue
+            # a scraper that can't even start would otherwise be restarted every second
+            self.failures[index] += 1
+            delay = _backoff(self.failures[index])
+            log.warning("pool worker %s died (exit code %s), restarting in %ss", index, worker.exitcode, delay)
+            with self.lock:
+                job_id = self.running.pop(index, None)
+                future = self.futures.pop(job_id, None)
+                self.restart_at[index] = time.time() + delay
+            if future is not None:
+                future.set_exception(WebDriverException("pool worker died"))
+
+    def submit(self, method, *args, **kwargs):
+        """Queue a Scraper method call, return concurrent.futures.Future"""
+        if self.closed:
+            raise RuntimeError("pool is closed")
+        future = Future()
+        with self.lock:
+            job_id = next(self.job_ids)
+            self.futures[job_id] = future
+            self.queue.append((job_id, method, args, kwargs))
+            self._dispatch()
+        return future
+
+    def call(self, method, *args, **kwargs):
+        """Run the job and wait for its result. After timeout seconds raise
+        concurrent.futures.TimeoutError, a job still in the queue is dropped then."""
+        timeout = kwargs.pop('timeout', None)
+        future = self.submit(method, *args, **kwargs)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def get_availability(self, catalog_number, timeout=None, **kwargs):
+        return self.call('get_availability', catalog_number, timeout=timeout, **kwargs)
+
+    def get_tracking(self, order_number, timeout=None, **kwargs):
+        return self.call('get_tracking', order_number, timeout=timeout, **kwargs)
+
+    def get_confirmation(self, order_number, timeout=None, **kwargs):
+        return self.call('get_confirmation', order_number, timeout=timeout, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            busy = len(self.running)
+            queued = len(self.queue)
+            completed = self.completed
+        return {
+            'workers': self.size,
+            'busy': busy,
+            'queue_depth': queued,
+            'utilization': float(busy) / self.size,
+            'completed': completed,
+        }
+
+    def close(self, timeout=60):
+        """Drop the queued jobs and stop the workers, the ones still busy after
+        timeout seconds are terminated and their jobs failed."""
+        if self.closed:
+            return
+        self.closed = True
+        with self.lock:
+            queued = [self.futures.pop(job_id, None) for job_id, _, _, _ in self.queue]
+            self.queue.clear()
+        for future in queued:
+            if future is not None:
+                future.cancel()
+        for tasks in self.tasks:
+            tasks.put(None)
+        deadline = time.time() + timeout
+        for index, worker in enumerate(self.workers):
+            if self.restart_at[index] is not None:
+                continue
+            worker.join(max(deadline - time.time(), 0))
+            if worker.is_alive():
+                log.warning("pool worker %s didn't stop in %ss, terminating", index, timeout)
+                worker.terminate()
+                worker.join()
+        self.results.put(('stop', None, None))
+        self.collector.join()
+        with self.lock:
+            running = [self.futures.pop(job_id, None) for job_id in self.running.values()]
+            self.running.clear()
+        for future in running:
+            if future is not None:
+                future.set_exception(WebDriverException("pool closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,105 +1,794 @@
 # -*- coding: utf-8 -*-
+import copy
+import datetime
+import functools
+import json
+import logging
+import os
 import re
+import sqlite3
+import tempfile
+import threading
 import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 
+import lxml.etree
+import lxml.html
+import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import urlparse
 from selenium.common.exceptions import NoSuchElementException, WebDriverException
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 
+from catalog_cache import CatalogNumberCache
+from html_text import element_text, xpath_attr, xpath_text
 from scrapers.parsers.base import BaseSpider, PlaceOrderMixin, SeleniumMixin
 from utils.dates import next_business_days
 
 
+class Instrumentation(object):
+    """Timed spans around scraper calls and page navigations plus WebDriver command counters.
+
+    Every finished span is logged as one JSON line. prometheus() returns the totals in the
+    Prometheus text format. With trace_dir set every top level call also dumps its span tree
+    with the commands sent by each span.
+    """
+
+    def __init__(self, logger=None, trace_dir=None):
+        self.log = logger or logging.getLogger('scraper.instrumentation')
+        self.trace_dir = trace_dir
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.span_calls = Counter()
+        self.span_errors = Counter()
+        self.span_seconds = defaultdict(float)
+        self.command_calls = Counter()
+        self.command_seconds = defaultdict(float)
+
+    def install(self, browser):
+        """Route the browser's WebDriver commands through the counters"""
+        if getattr(browser, '_instrumentation', None) is self:
+            return
+        execute = browser.execute
+
+        def instrumented_execute(driver_command, params=None):
+            if driver_command == 'get':
+                with self.span('navigate', url=(params or {}).get('url')):
+                    return self._execute(execute, driver_command, params)
+            return self._execute(execute, driver_command, params)
+
+        browser.execute = instrumented_execute
+        browser._instrumentation = self
+
+    def _execute(self, execute, driver_command, params):
+        started = time.time()
+        try:
+            return execute(driver_command, params)
+        finally:
+            elapsed = time.time() - started
+            with self.lock:
+                self.command_calls[driver_command] += 1
+                self.command_seconds[driver_command] += elapsed
+            stack = getattr(self.local, 'stack', None)
+            if stack:
+                stack[-1]['commands'][driver_command] += 1
+
+    @contextmanager
+    def span(self, name, **attrs):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        node = {'name': name, 'attrs': attrs, 'start': time.time(), 'commands': Counter(), 'children': []}
+        if stack:
+            stack[-1]['children'].append(node)
+        stack.append(node)
+        error = None
+        try:
+            yield node
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            stack.pop()
+            node['seconds'] = time.time() - node['start']
+            node['error'] = repr(error) if error is not None else None
+            commands = sum(node['commands'].values())
+            for child in node['children']:
+                commands += child['total_commands']
+            node['total_commands'] = commands
+            with self.lock:
+                self.span_calls[name] += 1
+                self.span_seconds[name] += node['seconds']
+                if error is not None:
+                    self.span_errors[name] += 1
+            self.log.info(json.dumps({'event': 'span', 'span': name, 'seconds': round(node['seconds'], 4),
+                                      'commands': commands, 'error': node['error'], 'attrs': attrs}))
+            if not stack and self.trace_dir:
+                self.dump_trace(node)
+
+    def dump_trace(self, node):
+        path = os.path.join(self.trace_dir, '%s-%.6f.json' % (node['name'], node['start']))
+        try:
+            with open(path, 'w') as f:
+                json.dump(node, f, indent=2, default=str)
+        except (IOError, OSError):
+            self.log.exception("failed to dump trace")
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            metrics = [
+                ('scraper_span_seconds_total', 'counter', 'Seconds spent in scraper calls', 'span',
+                 self.span_seconds),
+                ('scraper_span_calls_total', 'counter', 'Scraper calls', 'span', self.span_calls),
+                ('scraper_span_errors_total', 'counter', 'Scraper calls that raised', 'span', self.span_errors),
+                ('scraper_webdriver_commands_total', 'counter', 'WebDriver commands sent', 'command',
+                 self.command_calls),
+                ('scraper_webdriver_command_seconds_total', 'counter', 'Seconds spent in WebDriver commands',
+                 'command', self.command_seconds),
+            ]
+            for metric, kind, help_text, label, values in metrics:
+                lines.append('# HELP %s %s' % (metric, help_text))
+                lines.append('# TYPE %s %s' % (metric, kind))
+                for key in sorted(values):
+                    lines.append('%s{%s="%s"} %s' % (metric, label, key, values[key]))
+        return '\n'.join(lines) + '\n'
+
+
+def traced(method):
+    """Time the method with the scraper's instrumentation, a plain call when it's disabled.
+    The tracked browser position can't be trusted after an error, so it's forgotten."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            if not self.INSTRUMENT:
+                return method(self, *args, **kwargs)
+            instrumentation = self.instrumentation
+            instrumentation.install(self.browser)
+            with instrumentation.span(name):
+                return method(self, *args, **kwargs)
+        except Exception:
+            self.navigation.reset()
+            raise
+    return wrapper
+
+
+class NavigationState(object):
+    """Where the browser is: the window, the URL loaded in it and the frame path inside it.
+    None means unknown, the next navigation or switch goes to the browser."""
+
+    def __init__(self):
+        self.main_window = None
+        self.reset()
+
+    def reset(self, browser_restarted=False):
+        self.window = None
+        self.url = None
+        self.frame_path = None
+        if browser_restarted:
+            self.main_window = None
+
+
+class BusinessCalendar(object):
+    """Ship dates by lead days, computed with one next_business_days() call per day.
+    Also remembers formatted portal dates, the same few repeat on every row."""
+
+    def __init__(self, horizon=120, max_formatted=10000):
+        self.horizon = horizon
+        self.max_formatted = max_formatted
+        self.lock = threading.Lock()
+        self.day = None
+        self.lead_dates = []
+        self.formatted = {}
+
+    def refresh(self):
+        today = datetime.date.today()
+        if self.day == today:
+            return
+        with self.lock:
+            if self.day != today:
+                self.lead_dates = [day[0] for day in next_business_days(self.horizon)]
+                self.formatted = {}
+                self.day = today
+
+    def lead_date(self, lead_days):
+        self.refresh()
+        if 0 < lead_days <= len(self.lead_dates):
+            return self.lead_dates[lead_days - 1]
+        return next_business_days(lead_days)[-1][0]
+
+    def format_date(self, text, format_date):
+        self.refresh()
+        try:
+            return self.formatted[text]
+        except KeyError:
+            pass
+        value = format_date(text)
+        if len(self.formatted) < self.max_formatted:
+            self.formatted[text] = value
+        return value
+
+
+class HttpSessionError(Exception):
+    """The plain HTTP session expired or the page doesn't look as expected, use the browser instead"""
+
+
+class BrowserRequired(Exception):
+    """The page can't be done with plain HTTP, only this call uses the browser"""
+
+
+class OrderStatusIndex(object):
+    """Last seen status of every PO, so a sweep visits only the changed orders.
+    Database errors are logged and read as unknown statuses, the orders are visited again."""
+
+    def __init__(self, path, timeout=10, logger=None):
+        self.log = logger or logging.getLogger('scraper.order_status')
+        self.errors = 0
+        self.lock = threading.Lock()
+        # other processes share the file, wait for their writes instead of failing
+        self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS order_status ('
+                        'po_number TEXT PRIMARY KEY, status TEXT NOT NULL, updated REAL NOT NULL)')
+        self.db.commit()
+
+    @classmethod
+    def open(cls, path, logger=None, **kwargs):
+        """The index in the file at path, in memory if the file can't be used"""
+        try:
+            return cls(path, logger=logger, **kwargs)
+        except sqlite3.Error:
+            (logger or logging.getLogger('scraper.order_status')).exception(
+                "failed to open order status index %s, using memory", path)
+            return cls(':memory:', logger=logger, **kwargs)
+
+    def get(self, po_number):
+        with self.lock:
+            try:
+                row = self.db.execute('SELECT status FROM order_status WHERE po_number = ?',
+                                      (po_number,)).fetchone()
+            except sqlite3.Error:
+                self.failed("read")
+                return None
+        return row[0] if row else None
+
+    def set(self, po_number, status):
+        with self.lock:
+            try:
+                self.db.execute('INSERT OR REPLACE INTO order_status VALUES (?, ?, ?)',
+                                (po_number, status, time.time()))
+                self.db.commit()
+            except sqlite3.Error:
+                self.failed("write")
+
+    def failed(self, operation):
+        # must be called holding the lock
+        self.errors += 1
+        self.log.exception("order status index %s failed", operation)
+        try:
+            self.db.rollback()
+        except sqlite3.Error:
+            pass
+
+
 class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
     DOMAIN = 'https://www.xxxxxxxxxxxxxxxx.com'
+    HELP_VALUES_URL = ('/b2b_altra/base/helpvalues.do?'
+                       'helpValuesSearch=Product&KUNNR[1]=0000002694&parameterIndex=1')
+    SEARCH_ORDERS_URL = ('/b2b_altra/genericsearch.do?genericsearch.name=SearchCriteria_B2B_Sales'
+                         '&genericsearch.start=true&GSdateformat=mm/dd/yyyy'
+                         '&GSnumberformat=%23%2c%23%230.%23%23%23&GSlanguage=EN'
+                         '&GSdocumenthandlernoadd=&rc_documenttypes=ORDER&rc_status_head1='
+                         '&rc_attributesUI={window}&rc_datetoken5={window}'
+                         '&rc_attsubcharUI=PURCHASE_ORDER&rc_po_number_uc={po_number}')
+    ORDER_DETAIL_URL = '/b2b_altra/ecombase/documentstatus/orderstatusdetail.jsp'
+    # search result links that select an order in the session, the others need the browser
+    DOCUMENT_STATUS_LINK = re.compile(r'/documentstatus\w*\.do$')
+    # read-only pages are fetched with plain HTTP using the browser's login cookies
+    HTTP_MODE = False
+    HTTP_POOL_SIZE = 4
+    HTTP_TIMEOUT = 30
+    http = None
+    http_ok = False
+    # the login cookies are reused by the next processes when this is a path, e.g.
+    # os.path.join(tempfile.gettempdir(), 'altra_session.json'). The DOMAIN, USERNAME and
+    # session_key are added to the file name, so every account and pool worker has its own.
+    SESSION_FILE = None
+    session_key = None
+    # touch the portal session more often than it times out
+    SESSION_KEEPALIVE = 10 * 60
+    login_method = None
+    login_time = None
+    _keepalive = None
+    _help_values = None
+    # tracking/confirmation results are reused for a while after get_order_status
+    ORDER_SNAPSHOT_TTL = 60
+    _order_snapshots = None
+    # last seen order statuses, None keeps them in a file per DOMAIN and USERNAME in the temp dir
+    ORDER_STATUS_PATH = None
+    # header texts of the search results columns used by sweep_orders
+    SWEEP_PO_HEADERS = ('purchase order', 'po number', 'your reference')
+    SWEEP_STATUS_HEADERS = ('status',)
+    _order_status_index = None
+    # new product id -> old catalog number translations survive between runs,
+    # None keeps them in a file per DOMAIN in the temp dir
+    CATALOG_CACHE_PATH = None
+    CATALOG_CACHE_TTL = 30 * 24 * 3600
+    _catalog_cache = None
+    # spans, WebDriver command counters and optional trace dumps, see Instrumentation
+    INSTRUMENT = False
+    TRACE_DIR = None
+    _instrumentation = None
+    _navigation = None
+    # shared by all the scrapers of the process
+    business_calendar = BusinessCalendar()
+    # lines of the order_positions table, the steps of place_order are timed by the spans
+    order_lines = 0
 
     # Necessary for filling the item table in the order details window.
     # because there are multiple windows and clicking the element doesn't work properly
+    # Every argument is one line: the field values followed by the line index.
     JSCODE = '''
         (function () {
             var fields = ["product","ZZBISMT","MAKTG","quantity","NAME2","VSTEL","plant",
                         "LAND1","AVAILQTY","MEINS","UNIT_PRICE","LIST_PRICE","DZEIT",
                         "NAME1","STRAS","ORT01","REGIO","PSTLZ"];
             var formObject = opener.document.forms["order_positions"];
-            var fieldObject;
-            for(var i=0;i<arguments.length - 1; i++){
-                field_name = fields[i] +"\x5b"+ arguments[arguments.length - 1] + "\x5d";
-                fieldObject = formObject.elements[field_name];
-                if (fieldObject != null) {
-                  fieldObject.value = arguments[i];
+            var fieldObject, line;
+            for(var j=0;j<arguments.length; j++){
+                line = arguments[j];
+                for(var i=0;i<line.length - 1; i++){
+                    field_name = fields[i] +"\x5b"+ line[line.length - 1] + "\x5d";
+                    fieldObject = formObject.elements[field_name];
+                    if (fieldObject != null) {
+                      fieldObject.value = line[i];
+                    }
                 }
             }
         })(
     '''
 
+    @property
+    def navigation(self):
+        if self._navigation is None:
+            self._navigation = NavigationState()
+        return self._navigation
+
+    def navigate(self, url, reuse=False):
+        """Load the url. With reuse it's skipped if the browser is still on that page."""
+        navigation = self.navigation
+        if reuse and navigation.url == url and navigation.frame_path is None:
+            return False
+        self.browser.get(url)
+        # loading a page leaves the frames
+        navigation.url, navigation.frame_path = url, None
+        return True
+
+    def switch_to_frame(self, frame_path):
+        navigation = self.navigation
+        if navigation.frame_path == frame_path:
+            return
+        self.switch_to_frame_by_attr('name', frame_path=frame_path)
+        navigation.frame_path = frame_path
+
+    def switch_to_window(self, handle):
+        navigation = self.navigation
+        if navigation.window == handle:
+            return
+        self.browser.switch_to_window(handle)
+        # switching windows leaves the frames, the url was tracked for the other window
+        navigation.window, navigation.url, navigation.frame_path = handle, None, None
+
+    def switch_to_main_window(self):
+        navigation = self.navigation
+        if navigation.main_window is None:
+            navigation.main_window = self.browser.window_handles[0]
+        self.switch_to_window(navigation.main_window)
+
+    def switch_to_last_window(self):
+        self.switch_to_window(self.browser.window_handles[-1])
+
+    @property
+    def instrumentation(self):
+        if self._instrumentation is None:
+            self._instrumentation = Instrumentation(self.log, self.TRACE_DIR)
+        return self._instrumentation
+
+    @traced
     def login(self):
-        self.browser.get(self.DOMAIN + '/b2b_altra/b2b/init.do?scenario.xcm=ALTRA')
+        started = time.time()
+        if self.restore_session():
+            self.login_method, self.login_time = 'restored', time.time() - started
+            self.log.info("restored session in %.2fs", self.login_time)
+            self.start_keepalive()
+            return True
+        self.navigate(self.DOMAIN + '/b2b_altra/b2b/init.do?scenario.xcm=ALTRA')
         try:
             self.browser.find_element_by_name("UserId").send_keys(self.USERNAME)
             self.browser.find_element_by_name("nolog_password").send_keys(self.PASSWORD)
             self.browser.find_element_by_name("login").click()
+            self.navigation.url = None
             # they added even more iframes
-            self.switch_to_frame_by_attr('name', frame_path='isaTop/header')
+            self.switch_to_frame('isaTop/header')
             WebDriverWait(self.browser, 15).until(
                 EC.element_to_be_clickable((By.XPATH, ".//*[contains(., 'Log off')]")))
             self.logged_in = True
-            return True
         except Exception:
             self.log.exception("failed to login")
+            self.navigation.reset()
+            return False
+        self.login_method, self.login_time = 'full', time.time() - started
+        self.log.info("logged in in %.2fs", self.login_time)
+        if self.HTTP_MODE or self.SESSION_FILE:
+            self.export_cookies()
+        if self.SESSION_FILE:
+            self.save_session()
+            self.start_keepalive()
+        return True
+
+    def session_path(self):
+        if not self.SESSION_FILE:
+            return None
+        return self.keyed_path(self.SESSION_FILE, self.USERNAME, self.session_key)
+
+    def save_session(self):
+        try:
+            session = {
+                'cookies': self.browser.get_cookies(),
+                'home_url': self.browser.current_url,
+                'saved': time.time(),
+            }
+            # the cookies let anybody act as us, keep them private
+            fd = os.open(self.session_path(), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(session, f)
+        except (WebDriverException, IOError, OSError):
+            self.log.exception("failed to save session")
+
+    @traced
+    def restore_session(self):
+        """Load the saved login cookies into the browser. Return False if they are missing or rejected."""
+        path = self.session_path()
+        if not path:
+            return False
+        try:
+            with open(path) as f:
+                session = json.load(f)
+            cookies, home_url = session['cookies'], session['home_url']
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+        try:
+            # cookies can be added for the current domain only
+            self.navigate(self.DOMAIN + '/favicon.ico')
+            self.browser.delete_all_cookies()
+            for cookie in cookies:
+                cookie.pop('expiry', None)
+                self.browser.add_cookie(cookie)
+            if not self.export_cookies():
+                return False
+            self.http_get(home_url)
+            self.navigate(home_url)
+            self.switch_to_frame('isaTop/header')
+        except HttpSessionError as e:
+            self.log.info("saved session rejected: %s", e)
+            self.browser.delete_all_cookies()
+            self.http_ok = False
+            # the next processes would try it again
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return False
+        except WebDriverException:
+            self.log.exception("failed to restore session")
+            self.navigation.reset()
+            return False
+        self.logged_in = True
+        return True
+
+    def start_keepalive(self):
+        if not self.SESSION_KEEPALIVE or self._keepalive is not None:
+            return
+        self._keepalive = threading.Event()
+        thread = threading.Thread(target=self._keepalive_loop, args=(self._keepalive,), name='altra-keepalive')
+        thread.daemon = True
+        thread.start()
+
+    def stop_keepalive(self):
+        if self._keepalive is not None:
+            self._keepalive.set()
+            self._keepalive = None
+
+    def _keepalive_loop(self, stopped):
+        # plain HTTP shares the session cookie with the browser, so the browser isn't touched from this thread
+        while not stopped.wait(self.SESSION_KEEPALIVE):
+            try:
+                self.http_get(self.HELP_VALUES_URL)
+            except HttpSessionError as e:
+                self.log.warning("session expired: %s", e)
+                self.logged_in = False
+                self.http_ok = False
+                self._keepalive = None
+                return
+
+    def export_cookies(self):
+        """Copy the browser's session cookies into a keep-alive requests session"""
+        try:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = self.browser.execute_script('return navigator.userAgent;')
+            for cookie in self.browser.get_cookies():
+                session.cookies.set(cookie['name'], cookie['value'],
+                                    domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        except WebDriverException:
+            self.log.exception("failed to export cookies")
+            self.http_ok = False
             return False
+        self.http = session
+        self.http_ok = True
+        return True
+
+    def http_enabled(self):
+        return self.HTTP_MODE and self.http_ok and self.logged_in
 
+    def http_fallback(self, error):
+        """Switch to the browser until the next login"""
+        self.log.warning("HTTP mode disabled, falling back to browser: %s", error)
+        self.http_ok = False
+        self._help_values = None
+
+    def http_get(self, url, method='GET', data=None):
+        if not url.startswith('http'):
+            url = self.DOMAIN + url
+        try:
+            if method.upper() == 'POST':
+                response = self.http.post(url, data=data, timeout=self.HTTP_TIMEOUT)
+            else:
+                response = self.http.get(url, params=data, timeout=self.HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            raise HttpSessionError(str(e))
+        if response.status_code != 200:
+            raise HttpSessionError("%s returned %s" % (url, response.status_code))
+        try:
+            tree = lxml.html.fromstring(response.content)
+        except (lxml.etree.ParserError, lxml.etree.XMLSyntaxError) as e:
+            raise HttpSessionError("%s returned no page: %s" % (url, e))
+        tree.make_links_absolute(response.url)
+        if tree.xpath("//input[@name='UserId']"):
+            raise HttpSessionError("session expired")
+        return tree
+
+    def http_search_product(self, product, input_name):
+        forms = self._help_values.xpath("//form[.//input[@name='product[1]']]")
+        if not forms:
+            raise HttpSessionError("help values form not found")
+        form = forms[0]
+        fields = dict(form.form_values())
+        fields['product[1]'] = fields['MAKTG[1]'] = ''
+        fields[input_name] = product
+        self._help_values = self.http_get(form.action or self.HELP_VALUES_URL, form.method, fields)
+        # no results still show the search form, anything else isn't the help values page
+        if not self._help_values.xpath("//form[.//input[@name='product[1]']] | //table[@class='itemlist']"):
+            raise HttpSessionError("help values search returned another page")
+        return self._help_values.xpath("//table[@class='itemlist']//tr")
+
+    def http_order_detail(self, order_number):
+        tree = self.http_get(self.SEARCH_ORDERS_URL.format(window='last_year', po_number=order_number))
+        if not tree.xpath("//table[@summary='Search Results']"):
+            raise HttpSessionError("search results not found")
+        rows = tree.xpath("//table[@summary='Search Results']//tr[./td[contains(., '%s')]]" % order_number)
+        if not rows:
+            self.log.info("failed to find PO #")
+            return None
+        links = [link for link in rows[0].xpath(".//a/@href") if self.document_status_link(link)]
+        if not links:
+            # e.g. the portal's onclick links
+            raise BrowserRequired("PO link can't be followed without a browser")
+        # the order is selected in the session by following the link
+        self.http_get(links[0])
+        detail = self.http_get(self.ORDER_DETAIL_URL)
+        if not self.order_detail_matches(detail, [element_text(cell) for cell in rows[0].xpath("./td")]):
+            raise BrowserRequired("order detail isn't the one of PO %s" % order_number)
+        return detail
+
+    def document_status_link(self, link):
+        """A plain link to the portal's document status action"""
+        url = urlparse(link)
+        return (url.scheme in ('http', 'https') and url.netloc == urlparse(self.DOMAIN).netloc
+                and self.DOCUMENT_STATUS_LINK.search(url.path) is not None)
+
+    def detail_order_number(self, tree):
+        try:
+            return xpath_text(tree, "//h1[contains(., 'Order:')]").split()[1].strip()
+        except (NoSuchElementException, IndexError):
+            return None
+
+    def order_detail_matches(self, tree, row_texts):
+        """The order detail page shows the order of the search result row, not the one selected before"""
+        order_number = self.detail_order_number(tree)
+        return bool(order_number) and any(order_number in text.split() for text in row_texts)
+
+    @traced
     def search_product(self, product, input_name):
+        if self._help_values is not None:
+            try:
+                return self.http_search_product(product, input_name)
+            except HttpSessionError as e:
+                self.http_fallback(e)
+                self.navigate(self.DOMAIN + self.HELP_VALUES_URL, reuse=True)
         self.browser.find_element_by_name('product[1]').clear()
         self.browser.find_element_by_name('MAKTG[1]').clear()
         self.fill_input_by_attr('name', attr_value=input_name, text=product)
-        self.click_link_by_attr('.', attr_value='Search', exact=True)
-        return self.browser.find_elements_by_xpath("//table[@class='itemlist']//tr")
+        # the help values page is reused, its old results table must not be read
+        self.click_and_wait('.', attr_value='Search', exact=True)
+        return self.page_tree().xpath("//table[@class='itemlist']//tr")
 
-    def get_availability(self, catalog_number, **kwargs):
-        if not self.logged_in and not self.login():
-            return {}, 0, False
+    def click_and_wait(self, attr, attr_value, exact=False):
+        """Click a link that submits the page and wait until the next page has loaded,
+        so a snapshot taken right after it can't be the old page"""
+        page = self.browser.find_element_by_tag_name('html')
+        self.click_link_by_attr(attr, attr_value=attr_value, exact=exact)
+        self.wait_for_next_page(page)
+
+    def wait_for_next_page(self, page):
+        """Wait until the html element page is replaced and the next page has loaded"""
+        def page_left(browser):
+            try:
+                page.tag_name
+            except WebDriverException:
+                # stale, while navigating Chrome may also answer that the node isn't in the document
+                return True
+            return False
+
+        wait = WebDriverWait(self.browser, self.DELAY)
+        wait.until(page_left)
+        wait.until(lambda browser: browser.execute_script('return document.readyState') == 'complete')
+
+    def page_tree(self):
+        """Parse the current page once instead of asking WebDriver for every cell.
+        A page that is still loading can have no document yet, it's read as an empty one."""
+        try:
+            return lxml.html.fromstring(self.browser.page_source)
+        except (lxml.etree.ParserError, lxml.etree.XMLSyntaxError):
+            return lxml.html.fromstring('<html></html>')
+
+    def open_help_values(self):
+        self._help_values = None
+        if self.http_enabled():
+            try:
+                self._help_values = self.http_get(self.HELP_VALUES_URL)
+                return
+            except HttpSessionError as e:
+                self.http_fallback(e)
+        # the search form is reused if the browser is still on it
+        self.navigate(self.DOMAIN + self.HELP_VALUES_URL, reuse=True)
+
+    def parse_availability(self, rows):
         availability, price, lead_date = {}, 0, None
-        self.browser.get(self.DOMAIN + '/b2b_altra/base/helpvalues.do?'
-                                       'helpValuesSearch=Product&KUNNR[1]=0000002694&parameterIndex=1')
-        rows = self.search_product(catalog_number, 'product[1]')
-        # search by descr might work for some products
-        if not rows:
-            rows = self.search_product(catalog_number, 'MAKTG[1]')
         for row in rows[1:]:
             try:
-                qty = self.clean_qty(row.find_element_by_xpath("./td[7]/a").text)
-                location = row.find_element_by_xpath("./td[14]/a").text
-                lead_days = int(row.find_element_by_xpath("./td[11]/a").text)
+                qty = self.clean_qty(xpath_text(row, "./td[7]/a"))
+                location = xpath_text(row, "./td[14]/a")
+                lead_days = int(xpath_text(row, "./td[11]/a"))
                 if lead_days:
-                    lead_date = next_business_days(lead_days)[-1][0]
+                    lead_date = self.business_calendar.lead_date(lead_days)
                 availability[location.strip()] = {
                     'qty': qty,
                     'lead_date': lead_date if lead_date and not qty else None
                 }
-                price = row.find_element_by_xpath("./td[9]/a")
-                price = self.clean_price(price.text)
+                price = self.clean_price(xpath_text(row, "./td[9]/a"))
             except (NoSuchElementException, ValueError):
                 self.log.exception("avail processing error")
                 continue
+        return availability, price
 
+    @traced
+    def get_availability(self, catalog_number, **kwargs):
+        if not self.logged_in and not self.login():
+            return {}, 0, False
+        self.open_help_values()
+        rows = self.search_product(catalog_number, 'product[1]')
+        # search by descr might work for some products
+        if not rows:
+            rows = self.search_product(catalog_number, 'MAKTG[1]')
+        availability, price = self.parse_availability(rows)
         return availability, price, True
 
+    @traced
+    def get_availability_bulk(self, catalog_numbers, **kwargs):
+        """Check availability of many products on one help values page.
+        Return dict {catalog_number: (availability, price, ok)}."""
+        if not self.logged_in and not self.login():
+            return dict((number, ({}, 0, False)) for number in catalog_numbers)
+        results, misses, seen = {}, [], set()
+        self.open_help_values()
+        for catalog_number in catalog_numbers:
+            if catalog_number in seen:
+                continue
+            seen.add(catalog_number)
+            rows = self._bulk_search(catalog_number, 'product[1]', results)
+            if rows is None:
+                continue
+            # search by descr might work for some products, but do it for the misses only
+            if not rows:
+                misses.append(catalog_number)
+                continue
+            availability, price = self.parse_availability(rows)
+            results[catalog_number] = availability, price, True
+        for catalog_number in misses:
+            rows = self._bulk_search(catalog_number, 'MAKTG[1]', results)
+            if rows is None:
+                continue
+            availability, price = self.parse_availability(rows)
+            results[catalog_number] = availability, price, True
+        return results
+
+    def _bulk_search(self, catalog_number, input_name, results):
+        try:
+            return self.search_product(catalog_number, input_name)
+        except WebDriverException:
+            self.log.exception("bulk avail search error: %s", catalog_number)
+            results[catalog_number] = {}, 0, False
+        # the page may be broken after the error
+        try:
+            self.open_help_values()
+        except WebDriverException:
+            self.log.exception("failed to reload help values page")
+        return None
+
+    def keyed_path(self, path, *keys):
+        """The path with the portal DOMAIN and the keys that aren't None added to the file name"""
+        parts = [urlparse(self.DOMAIN).netloc or self.DOMAIN] + [str(key) for key in keys if key is not None]
+        root, extension = os.path.splitext(path)
+        return '%s-%s%s' % (root, re.sub(r'[^\w.-]+', '_', '-'.join(parts)), extension)
+
+    @property
+    def catalog_cache(self):
+        if self._catalog_cache is None:
+            path = self.CATALOG_CACHE_PATH or self.keyed_path(
+                os.path.join(tempfile.gettempdir(), 'altra_catalog_numbers.sqlite3'))
+            self._catalog_cache = CatalogNumberCache.open(path, ttl=self.CATALOG_CACHE_TTL, logger=self.log)
+        return self._catalog_cache
+
     def replace_catalog_numbers(self, key, results):
         '''
         Replace new catalog numbers with old ones
         '''
-        self.browser.get(self.DOMAIN + '/b2b_altra/base/helpvalues.do?'
-                                       'helpValuesSearch=Product&KUNNR[1]=0000002694&parameterIndex=1')
-        for result in results:
+        self.replace_catalog_numbers_many([(key, results)])
+
+    @traced
+    def replace_catalog_numbers_many(self, groups):
+        '''
+        Replace new catalog numbers with old ones in several (key, results) groups.
+        Only the ids missing in the cache are searched, all in one help values page visit.
+        '''
+        pending = {}
+        for key, results in groups:
+            for result in results:
+                catalog_number = self.catalog_cache.get(result[key])
+                if catalog_number is None:
+                    pending.setdefault(result[key], []).append((key, result))
+                else:
+                    result[key] = catalog_number
+        if not pending:
+            return
+        self.open_help_values()
+        for product_id, product_results in pending.items():
             try:
-                self.fill_input_by_attr('name', attr_value='product[1]', text=result[key])
-                self.click_link_by_attr('.', attr_value='Search', exact=True)
-                result[key] = self.browser.find_element_by_xpath(
-                    "//table[@class='itemlist']//tr[2]/td[2]/a").text.strip()
-            except WebDriverException:
+                rows = self.search_product(product_id, 'product[1]')
+                catalog_number = xpath_text(rows[1], "./td[2]/a").strip()
+            except (WebDriverException, IndexError):
                 self.log.exception("failed to replace catalog number")
                 continue
+            self.catalog_cache.set(product_id, catalog_number)
+            for key, result in product_results:
+                result[key] = catalog_number
 
     def get_carrier_from_string(self, ship_data):
         if '.ups.com' in ship_data:
@@ -112,49 +801,72 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
             carrier = ''
         return carrier
 
+    @traced
     def search_po(self, order_number, **kwargs):
         if not self.logged_in and not self.login():
             return False
         try:
-            self.browser.get(self.DOMAIN + '/b2b_altra/genericsearch.do?genericsearch.name=SearchCriteria_B2B_Sales'
-                                           '&genericsearch.start=true&GSdateformat=mm/dd/yyyy'
-                                           '&GSnumberformat=%23%2c%23%230.%23%23%23&GSlanguage=EN'
-                                           '&GSdocumenthandlernoadd=&rc_documenttypes=ORDER&rc_status_head1='
-                                           '&rc_attributesUI=last_year&rc_datetoken5=last_year'
-                                           '&rc_attsubcharUI=PURCHASE_ORDER&rc_po_number_uc=' + order_number)
+            self.navigate(self.DOMAIN + self.SEARCH_ORDERS_URL.format(window='last_year', po_number=order_number))
             link = self.browser.find_element_by_xpath("//table[@summary='Search Results']"
                                                        "//tr[./td[contains(., '%s')]]//a" % order_number)
+            page = self.browser.find_element_by_tag_name('html')
             link.click()
+            self.navigation.url = None
+            # the link selects the order in the session, the detail page must not be loaded before
+            self.wait_for_next_page(page)
         except WebDriverException:
             self.log.info("failed to find PO #")
+            self.navigation.reset()
             return False
         return True
 
-    def get_tracking(self, order_number, **kwargs):
+    def order_detail(self, order_number):
+        """Find the PO and return the parsed page with the order data, None if not found"""
+        if not self.logged_in and not self.login():
+            return None
+        if self.http_enabled():
+            try:
+                return self.http_order_detail(order_number)
+            except BrowserRequired as e:
+                self.log.info("%s, using the browser", e)
+            except HttpSessionError as e:
+                self.http_fallback(e)
         if not self.search_po(order_number):
+            return None
+        self.navigate(self.DOMAIN + self.ORDER_DETAIL_URL)
+        return self.page_tree()
+
+    @traced
+    def get_tracking(self, order_number, **kwargs):
+        snapshot = self.order_snapshot(order_number)
+        if 'tracking' in snapshot:
+            return copy.deepcopy(snapshot['tracking'])
+        tree = self.order_detail(order_number)
+        if tree is None:
             return []
-        # the page with the order data
-        self.browser.get(self.DOMAIN + '/b2b_altra/ecombase/documentstatus/orderstatusdetail.jsp')
+        results = self.parse_tracking(tree)
+        self.replace_catalog_numbers('item_id', results)
+        self.save_order_snapshot(order_number, tracking=results)
+        return copy.deepcopy(results)
+
+    def parse_tracking(self, tree):
         results = []
-        rows = self.browser.find_elements_by_xpath("//table[@class='itemlist']//tr[contains(@id, 'row_')]")
-        rows_detail = self.browser.find_elements_by_xpath("//table[@class='itemlist']//tr[contains(@id, 'rowdetail_')]")
+        rows = tree.xpath("//table[@class='itemlist']//tr[contains(@id, 'row_')]")
+        rows_detail = tree.xpath("//table[@class='itemlist']//tr[contains(@id, 'rowdetail_')]")
         reg_expr = re.compile("&(?:InquiryNumber|tracknumbers)=(\w+)")
         for i, row in enumerate(rows):
             try:
-                product = row.find_element_by_xpath("./td[@class='product']")
-                date_elem = row.find_element_by_xpath("./td[@class='date-on']")
-                ship_date = self.format_date(date_elem.text.split()[0])
-                qty_elem = row.find_element_by_xpath("./td[@class='qty']")
-                qty = qty_elem.text.split()
-                track_elem = rows_detail[i].find_element_by_xpath(".//a[./img[@alt='External Order Tracking']]")
-                track_elem = track_elem.get_attribute('onclick')
+                product = xpath_text(row, "./td[@class='product']")
+                ship_date = self.ship_date(xpath_text(row, "./td[@class='date-on']").split()[0])
+                qty = xpath_text(row, "./td[@class='qty']").split()
+                track_elem = xpath_attr(rows_detail[i], ".//a[./img[@alt='External Order Tracking']]", 'onclick')
                 tracking = re.search(reg_expr, track_elem).groups(0)[0]
             except (NoSuchElementException, IndexError, ValueError):
                 self.log.exception("order details processing error")
                 track_elem, tracking, shipping_method = '', '', ''
             shipping_method = self.get_carrier_from_string(track_elem)
             result_dictionary = {
-                'item_id': product.text.strip(),
+                'item_id': product.strip(),
                 'status': 'not shipped' if not tracking else 'shipped',
                 'tracking_number': tracking,
                 'shipping_method': shipping_method,
@@ -164,32 +876,170 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
             results.append(result_dictionary)
 
         try:
-            cost = self.browser.find_element_by_xpath(
-                ".//td[contains(text(),'Shipping Costs:')]/following-sibling::td[1]").text
+            cost = xpath_text(tree, ".//td[contains(text(),'Shipping Costs:')]/following-sibling::td[1]")
             cost = self.clean_price(cost)
         except NoSuchElementException:
             cost = 0
         if results and cost:
             results[0]['shipping_cost'] = cost
-        self.replace_catalog_numbers('item_id', results)
         return results
 
+    def ship_date(self, text):
+        return self.business_calendar.format_date(text, self.format_date)
+
+    @traced
     def get_confirmation(self, order_number, **kwargs):
+        snapshot = self.order_snapshot(order_number)
+        if 'confirmation' in snapshot:
+            return copy.deepcopy(snapshot['confirmation'])
         if not self.search_po(order_number):
             return []
-        results = []
-        # the page with the order data
-        self.browser.get(self.DOMAIN + '/b2b_altra/ecombase/documentstatus/orderstatusdetail.jsp')
+        # the page with the order data, the address popup needs it in the browser
+        self.navigate(self.DOMAIN + self.ORDER_DETAIL_URL)
+        results = [self.parse_confirmation(self.page_tree())]
+        self.replace_catalog_numbers('catalog_number', results[0]['items'])
+        self.save_order_snapshot(order_number, confirmation=results)
+        return copy.deepcopy(results)
+
+    @traced
+    def get_order_status(self, order_number, **kwargs):
+        """Tracking and confirmation from one load of the order detail page.
+        Return dict with the get_tracking and get_confirmation results."""
+        snapshot = self.order_snapshot(order_number)
+        if 'tracking' in snapshot and 'confirmation' in snapshot:
+            return copy.deepcopy(snapshot)
+        if not self.search_po(order_number):
+            return {'tracking': [], 'confirmation': []}
+        self.navigate(self.DOMAIN + self.ORDER_DETAIL_URL)
+        tree = self.page_tree()
+        tracking = self.parse_tracking(tree)
+        confirmation = [self.parse_confirmation(tree)]
+        self.replace_catalog_numbers_many([('item_id', tracking),
+                                           ('catalog_number', confirmation[0]['items'])])
+        self.save_order_snapshot(order_number, tracking=tracking, confirmation=confirmation)
+        return copy.deepcopy({'tracking': tracking, 'confirmation': confirmation})
+
+    def order_snapshot(self, order_number):
+        """Recent results for the PO, so tracking and confirmation don't load it twice"""
+        snapshot = (self._order_snapshots or {}).get(order_number)
+        if snapshot is None or time.time() - snapshot['time'] > self.ORDER_SNAPSHOT_TTL:
+            return {}
+        return snapshot['data']
+
+    def save_order_snapshot(self, order_number, **data):
+        now = time.time()
+        if self._order_snapshots is None:
+            self._order_snapshots = {}
+        for key, snapshot in list(self._order_snapshots.items()):
+            if now - snapshot['time'] > self.ORDER_SNAPSHOT_TTL:
+                del self._order_snapshots[key]
+        snapshot = self._order_snapshots.setdefault(order_number, {'time': now, 'data': {}})
+        snapshot['data'].update(data)
+
+    @property
+    def order_status_index(self):
+        if self._order_status_index is None:
+            path = self.ORDER_STATUS_PATH or self.keyed_path(
+                os.path.join(tempfile.gettempdir(), 'altra_order_status.sqlite3'), self.USERNAME)
+            self._order_status_index = OrderStatusIndex.open(path, logger=self.log)
+        return self._order_status_index
+
+    def sweep_orders(self, window='last_year', changed_only=True):
+        """Search all the orders of a date window at once and visit only the ones
+        whose status changed since the last sweep. Yield (po_number, status, tracking)."""
+        if not self.logged_in and not self.login():
+            return
+        url = self.SEARCH_ORDERS_URL.format(window=window, po_number='')
+        tree = None
+        if self.http_enabled():
+            try:
+                tree = self.http_get(url)
+            except HttpSessionError as e:
+                self.http_fallback(e)
+        if tree is None:
+            self.navigate(self.DOMAIN + url)
+            tree = self.page_tree()
+            tree.make_links_absolute(self.DOMAIN + url)
+        for po_number, status, link, row_texts in self.parse_order_search(tree):
+            if changed_only and self.order_status_index.get(po_number) == status:
+                continue
+            try:
+                tree = self.order_detail_from_link(po_number, link, row_texts)
+            except WebDriverException:
+                self.log.exception("failed to open order %s", po_number)
+                continue
+            if tree is None:
+                continue
+            tracking = self.parse_tracking(tree)
+            self.replace_catalog_numbers('item_id', tracking)
+            self.save_order_snapshot(po_number, tracking=tracking)
+            yield po_number, status, copy.deepcopy(tracking)
+            # only once the caller got it, an order it failed on is visited again next time
+            self.order_status_index.set(po_number, status)
+
+    def parse_order_search(self, tree):
+        """Return [(po_number, status, link, texts of the row cells)] from the search results table"""
+        tables = tree.xpath("//table[@summary='Search Results']")
+        if not tables:
+            self.log.info("no search results")
+            return []
+        headers = [' '.join(element_text(th).lower().split()) for th in tables[0].xpath(".//tr[th][1]/th")]
         try:
-            confirm_number = self.browser.find_element_by_xpath("//h1[contains(., 'Order:')]").text
-            confirm_number = confirm_number.split()[1].strip()
-        except (NoSuchElementException, IndexError):
-            self.log.exception('Not found confirmation number')
+            po_column = next(i for i, header in enumerate(headers)
+                             if any(name in header for name in self.SWEEP_PO_HEADERS))
+            status_column = next(i for i, header in enumerate(headers)
+                                 if any(name in header for name in self.SWEEP_STATUS_HEADERS))
+        except StopIteration:
+            self.log.error("unexpected search results columns: %s", headers)
+            return []
+        orders = []
+        for row in tables[0].xpath(".//tr[td]"):
+            cells = row.xpath("./td")
+            try:
+                po_number = element_text(cells[po_column])
+                status = element_text(cells[status_column])
+            except IndexError:
+                continue
+            links = [link for link in row.xpath(".//a/@href") if self.document_status_link(link)]
+            if po_number:
+                orders.append((po_number, status, links[0] if links else '',
+                               [element_text(cell) for cell in cells]))
+        return orders
+
+    def order_detail_from_link(self, po_number, link, row_texts):
+        """Open the order from its search result link. The PO is searched if there's no
+        plain document status link or the detail page doesn't show the row's order."""
+        if not link:
+            return self.order_detail(po_number)
+        if self.http_enabled():
+            try:
+                self.http_get(link)
+                tree = self.http_get(self.ORDER_DETAIL_URL)
+                if not self.order_detail_matches(tree, row_texts):
+                    raise BrowserRequired("order detail isn't the one of PO %s" % po_number)
+                return tree
+            except BrowserRequired as e:
+                self.log.info("%s, using the browser", e)
+            except HttpSessionError as e:
+                self.http_fallback(e)
+        self.navigate(link)
+        self.navigate(self.DOMAIN + self.ORDER_DETAIL_URL)
+        tree = self.page_tree()
+        if not self.order_detail_matches(tree, row_texts):
+            self.log.warning("search result link of PO %s opened another order", po_number)
+            return self.order_detail(po_number)
+        return tree
+
+    def parse_confirmation(self, tree):
+        """The order detail page must be open in the browser, the address comes from its popup"""
+        confirm_number = self.detail_order_number(tree)
+        if confirm_number is None:
+            self.log.error('Not found confirmation number')
             confirm_number = ""
         # get an address
         try:
             self.click_link_by_attr('onclick', attr_value='showShipTo')
-            self.browser.switch_to_window(self.browser.window_handles[-1])
+            self.switch_to_last_window()
             address = []
             for name in ['lastName', 'firstName', 'street']:
                 address.append(self.browser.find_element_by_name(name).get_attribute('value'))
@@ -201,14 +1051,14 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
             state = state.first_selected_option.text.strip()
             address.append(' '.join([city, state, postal_code, country]))
             address = '\n'.join(address)
-            self.browser.switch_to_window(self.browser.window_handles[0])
+            self.switch_to_main_window()
         except WebDriverException:
             self.log.exception('Not found address')
+            self.navigation.reset()
             address = ""
         # get a shipping method
         try:
-            track_elem = self.browser.find_element_by_xpath("//a[./img[@alt='External Order Tracking']]")
-            track_elem = track_elem.get_attribute('onclick')
+            track_elem = xpath_attr(tree, "//a[./img[@alt='External Order Tracking']]", 'onclick')
         except WebDriverException:
             self.log.exception('Not found shipping method')
             shipping_method = ''
@@ -220,13 +1070,12 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
             "shipping_method": shipping_method,
             "items": []
         }
-        rows = self.browser.find_elements_by_xpath("//table[@class='itemlist']//tr[contains(@id, 'row_')]")
+        rows = tree.xpath("//table[@class='itemlist']//tr[contains(@id, 'row_')]")
         for row in rows:
             try:
-                item_id = row.find_element_by_xpath("./td[@class='product']").text
-                date_elem = row.find_element_by_xpath("./td[@class='date-on']")
-                ship_date = self.format_date(date_elem.text.split()[0])
-                qty = row.find_element_by_xpath("./td[@class='qty']").text
+                item_id = xpath_text(row, "./td[@class='product']")
+                ship_date = self.ship_date(xpath_text(row, "./td[@class='date-on']").split()[0])
+                qty = xpath_text(row, "./td[@class='qty']")
             except NoSuchElementException:
                 self.log.exception("order details processing error")
                 continue
@@ -236,39 +1085,65 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
                 'qty': self.clean_qty(qty.split()),
             }
             res['items'].append(result_dictionary)
-
-        self.replace_catalog_numbers('catalog_number', res['items'])
-        results.append(res)
-        return results
+        return res
 
     def cart_empty(self, empty=False):
         """Verify if cart is empty. Empty it if desired. Return boolean."""
         return True
 
+    @traced
     def put_items_in_cart(self, items):
         # create cart
-        self.switch_to_frame_by_attr('name', frame_path='isaTop/work_history/form_input')
+        self.switch_to_frame('isaTop/work_history/form_input')
         self.click_link_by_attr('onclick', attr_value='create_order')
-        # extend table of items
-        size_dropdown = WebDriverWait(self.browser, self.DELAY).until(
-            EC.visibility_of_element_located((By.ID, 'newposcount')))
-        Select(size_dropdown).select_by_value('15')
-        time.sleep(2)
-        self.click_link_by_attr('onclick', attr_value='submit_refresh')
+        # every item takes at least one line, choose_closest_warehouses adds more if it splits them
+        self.ensure_order_lines(len(items))
         return True
 
+    def order_line_capacity(self, tree=None):
+        tree = self.page_tree() if tree is None else tree
+        return len(tree.xpath("//form[@name='order_positions' or @id='order_positions']"
+                              "//input[starts-with(@name, 'product[')]"))
+
+    @traced
+    def ensure_order_lines(self, needed):
+        """Extend the table of items until it has the needed lines. Must be in the form_input frame."""
+        while True:
+            # the form is complete once the size dropdown shows, the snapshot must not be older
+            size_dropdown = WebDriverWait(self.browser, self.DELAY).until(
+                EC.visibility_of_element_located((By.ID, 'newposcount')))
+            tree = self.page_tree()
+            capacity = self.order_line_capacity(tree)
+            if capacity >= needed:
+                break
+            sizes = sorted(int(value) for value in tree.xpath("//select[@id='newposcount']/option/@value")
+                           if value.isdigit())
+            if not sizes:
+                raise NoSuchElementException("no sizes in the table size dropdown")
+            # the smallest chunk that fits, the biggest one otherwise
+            size = next((size for size in sizes if size >= needed - capacity), sizes[-1])
+            Select(size_dropdown).select_by_value(str(size))
+            self.click_link_by_attr('onclick', attr_value='submit_refresh')
+            WebDriverWait(self.browser, self.DELAY).until(
+                lambda browser: self.order_line_capacity() > capacity)
+        self.order_lines = capacity
+
+    @traced
     def choose_closest_warehouses(self, x, items, detailed_availability):
         self.click_link_by_attr('onclick', attr_value='getHelpValuesPopupProduct')
-        self.browser.switch_to_window(self.browser.window_handles[-1])
+        self.switch_to_last_window()
         weight_per_warehouse, ordered_items = {}, {}
+        # warehouse links per catalog number, every product is searched once
+        warehouses = {}
+        lines = []
         index = 1
         for item in items:
             ordered_items[item['catalog_number']] = {}
             avail_product = detailed_availability[item['catalog_number']]
             qty, weight = item['qty'], item['weight']
             qty_ordered = 0
-            self.fill_input_by_attr('name', attr_value='product', text=item['catalog_number'])
-            self.click_link_by_attr('.', attr_value='Search')
+            if item['catalog_number'] not in warehouses:
+                warehouses[item['catalog_number']] = self.search_warehouses(item['catalog_number'])
             # choose warehouses
             for elem in avail_product:
                 location = elem["location_code"]
@@ -277,22 +1152,19 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
                 if not avail_qty:
                     continue
                 # select the right warehouse
-                xpath = "//table[@class='itemlist']//a[normalize-space(.)='{}']".format(location)
-                try:
-                    warehouse = self.browser.find_element_by_xpath(xpath)
-                except NoSuchElementException:
+                href = warehouses[item['catalog_number']].get(location)
+                if href is None:
                     continue
-                item_info = re.findall(r"\'.+?\'", warehouse.get_attribute("href"))
+                item_info = re.findall(r"\'.+?\'", href)
                 try:
                     # add new product id. It's necessary for later verification 
                     item['new_product_id'] = item_info[0].strip('\'')
                     item_info[3] = "'{}'".format(needed_qty)
                 except IndexError:
                     return False, weight_per_warehouse, ordered_items
-                # fill product field with JavaScript
+                # the product fields are filled with JavaScript for all the lines at once
                 item_info.append(str(index))
-                js_script = self.JSCODE + ','.join(item_info) + ');'
-                self.browser.execute_script(js_script)
+                lines.append(item_info)
                 # sum the weights per warehouse to choose the shipping method later
                 try:
                     weight_per_warehouse[location] += weight * needed_qty
@@ -307,11 +1179,34 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
                     break
             else:
                 return False, weight_per_warehouse, ordered_items
+            # one cache write per item, its lines share the product id
+            self.catalog_cache.set(item['new_product_id'], item['catalog_number'])
+        if len(lines) > self.order_lines:
+            # split items need more lines than put_items_in_cart prepared
+            popup = self.navigation.window
+            self.switch_to_main_window()
+            self.switch_to_frame('isaTop/work_history/form_input')
+            self.ensure_order_lines(len(lines))
+            self.switch_to_window(popup)
+        if lines:
+            js_script = self.JSCODE + ','.join('[' + ','.join(line) + ']' for line in lines) + ');'
+            self.browser.execute_script(js_script)
         return True, weight_per_warehouse, ordered_items
 
+    @traced
+    def search_warehouses(self, catalog_number):
+        """Search the product in the popup, return {location: warehouse link href}"""
+        self.fill_input_by_attr('name', attr_value='product', text=catalog_number)
+        self.click_and_wait('.', attr_value='Search')
+        warehouses = {}
+        for link in self.page_tree().xpath("//table[@class='itemlist']//a"):
+            warehouses.setdefault(element_text(link), link.get('href') or '')
+        return warehouses
+
+    @traced
     def fill_client_details(self, x, order_details, weight_per_warehouse):
-        self.browser.switch_to_window(self.browser.window_handles[0])
-        self.switch_to_frame_by_attr('name', frame_path='isaTop/work_history/form_input')
+        self.switch_to_main_window()
+        self.switch_to_frame('isaTop/work_history/form_input')
         self.click_link_by_attr('onclick', attr_value='newShipTo')
         # fill company and customer names
         if order_details['first_name'] or order_details['last_name']:
@@ -369,19 +1264,22 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
                 correct = False
         return correct
 
+    @traced
     def verify_order_placed(self, x, order_details, ordered_items):
         """Review the order details and if what we ordered is what we needed. Return boolean"""
         xpath = "(//div[@class='header-itemdefault']//td[@class='value'])[1]"
-        raw_address = self.browser.find_element_by_xpath(xpath).text.split('...')
+        # submit_simulate is still loading the review page, the snapshot must wait for it
+        WebDriverWait(self.browser, self.DELAY).until(EC.presence_of_element_located((By.XPATH, xpath)))
+        tree = self.page_tree()
+        raw_address = xpath_text(tree, xpath).split('...')
         address_info = [el.strip(' .') for el in raw_address]
         correct = self.verify_address(order_details, address_info)
         verify_items = {}
-        rows = self.browser.find_elements_by_xpath("//td[@class='product']/parent::tr")
+        rows = tree.xpath("//td[@class='product']/parent::tr")
         for row in rows:
             try:
-                part = row.find_element_by_xpath(".//td[@class='product']").text.strip()
-                qty = row.find_element_by_xpath(".//td[@class='qty']")
-                qty = self.clean_qty(qty.text.split())
+                part = xpath_text(row, ".//td[@class='product']").strip()
+                qty = self.clean_qty(xpath_text(row, ".//td[@class='qty']").split())
             except (NoSuchElementException, ValueError, IndexError):
                 self.log.exception("product/qty processing error")
                 return False, x
@@ -397,6 +1295,7 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
                 self.log.warning("order verification: wrong qty selected for product {0}".format(cat_num))
         return correct, x
 
+    @traced
     def submit_order(self, x):
         try:
             self.browser.find_element_by_name('termsAccepted').click()
@@ -413,9 +1312,18 @@ class Scraper(SeleniumMixin, PlaceOrderMixin, BaseSpider):
             confirmation_number, success = '', False
         return success, confirmation_number
 
+    def quit_browser(self):
+        self.stop_keepalive()
+        self.navigation.reset(browser_restarted=True)
+        self.logged_in = False
+        self.http_ok = False
+        return super(Scraper, self).quit_browser()
+
+    @traced
     def place_order(self, order_details, submit=False, **kwargs):
         """Fill the details for an order and submit it if desired.
         Return boolean status, confirmation #, dict with ordered items/warehouses."""
+        self.order_lines = 0
         try:
             return super(Scraper, self).place_order(order_details, submit, **kwargs)
         except WebDriverException:
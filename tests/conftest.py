@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture_path(name):
+    return os.path.join(FIXTURES, name)
+
+
+@pytest.fixture(scope='session')
+def browser():
+    """Headless Chrome, CHROMEDRIVER and CHROME_BINARY point to the binaries if they aren't on the PATH"""
+    webdriver = pytest.importorskip('selenium.webdriver')
+    from selenium.common.exceptions import WebDriverException
+    options = webdriver.ChromeOptions()
+    if os.environ.get('CHROME_BINARY'):
+        options.binary_location = os.environ['CHROME_BINARY']
+    for argument in ('--headless', '--no-sandbox', '--disable-gpu', '--disable-dev-shm-usage'):
+        options.add_argument(argument)
+    try:
+        driver = webdriver.Chrome(executable_path=os.environ.get('CHROMEDRIVER', 'chromedriver'), options=options)
+    except WebDriverException as e:
+        pytest.skip("Chrome isn't available: %s" % e)
+    yield driver
+    driver.quit()
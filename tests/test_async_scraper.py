@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""AsyncScraper bookkeeping with a pool whose jobs the test finishes by hand"""
+import asyncio
+from concurrent.futures import Future
+
+import pytest
+
+async_scraper = pytest.importorskip('async_scraper')
+
+
+class FakePool(object):
+    size = 2
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, method, *args, **kwargs):
+        self.jobs.append(Future())
+        return self.jobs[-1]
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+async def settle():
+    # let the callbacks and the limiter release run
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def run(finish):
+    """Start a get_tracking call, finish its job and return (outcome, limiter)"""
+    async def main():
+        fake_pool = FakePool()
+        scraper = async_scraper.AsyncScraper(pool=fake_pool)
+        call = asyncio.ensure_future(scraper.get_tracking('PO00001'))
+        await settle()
+        finish(fake_pool.jobs[0])
+        try:
+            outcome = await call
+        except BaseException as e:
+            outcome = e
+        await settle()
+        return outcome, scraper.limiter
+    return asyncio.run(main())
+
+
+def test_empty_result_isnt_an_error():
+    outcome, limiter = run(lambda job: job.set_result([]))
+    assert outcome == []
+    assert list(limiter.outcomes) == [False] and limiter.in_flight == 0
+
+
+@pytest.mark.parametrize('error', [async_scraper.LoginError("no login"),
+                                   async_scraper.WebDriverException("browser died")])
+def test_portal_failures_are_errors(error):
+    outcome, limiter = run(lambda job: job.set_exception(error))
+    assert outcome is error
+    assert list(limiter.outcomes) == [True] and limiter.in_flight == 0
+
+
+def test_cancelled_job_releases_the_slot():
+    # ScraperPool.close() cancels the queued jobs
+    outcome, limiter = run(lambda job: job.cancel())
+    assert isinstance(outcome, asyncio.CancelledError)
+    assert limiter.in_flight == 0 and not limiter.outcomes
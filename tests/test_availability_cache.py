@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+import availability_cache
+from availability_cache import AvailabilityCache, approximate_size
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(availability_cache.time, 'time', clock)
+    return clock
+
+
+class Fetch(object):
+    """get_availability stand-in, returns results in turn and blocks while the gate is closed"""
+
+    def __init__(self, *results):
+        self.results = list(results) or [({'WH01': {'qty': 1}}, 1.0, True)]
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, catalog_number):
+        self.calls += 1
+        self.gate.wait(10)
+        result = self.results[min(self.calls, len(self.results)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def wait_for(condition, timeout=10):
+    # counted in sleeps, time.time may be the test clock
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        time.sleep(0.01)
+    assert condition(), "timed out"
+
+
+def get_in_threads(cache, catalog_number, count):
+    """Start count get() calls, return their outcomes once joined"""
+    outcomes = [None] * count
+
+    def get(n):
+        try:
+            outcomes[n] = cache.get(catalog_number)
+        except Exception as e:
+            outcomes[n] = e
+
+    threads = [threading.Thread(target=get, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+
+    def join():
+        for thread in threads:
+            thread.join(10)
+        return outcomes
+    return join
+
+
+def test_concurrent_misses_fetch_once():
+    fetch = Fetch()
+    fetch.gate.clear()
+    cache = AvailabilityCache(fetch)
+    join = get_in_threads(cache, 'SKU-1', 5)
+    wait_for(lambda: cache.stats()['coalesced'] == 4)
+    fetch.gate.set()
+    assert join() == [fetch.results[0]] * 5
+    assert fetch.calls == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_stale_hit_refreshes_once(clock):
+    old, new = ({}, 1.0, True), ({}, 2.0, True)
+    fetch = Fetch(old, new)
+    cache = AvailabilityCache(fetch, ttl=60, stale_ttl=300)
+    assert cache.get('SKU-1') == old
+    clock.now += 61
+    fetch.gate.clear()
+    assert [cache.get('SKU-1') for _ in range(3)] == [old] * 3
+    fetch.gate.set()
+    wait_for(lambda: not cache.flights)
+    assert cache.get('SKU-1') == new
+    assert fetch.calls == 2
+    stats = cache.stats()
+    assert stats['refreshes'] == 1 and stats['stale_hits'] == 3 and stats['hits'] == 1
+
+
+def test_expired_entry_is_a_miss(clock):
+    fetch = Fetch(({}, 1.0, True), ({}, 2.0, True))
+    cache = AvailabilityCache(fetch, ttl=60, stale_ttl=300)
+    cache.get('SKU-1')
+    clock.now += 361
+    assert cache.get('SKU-1')[1] == 2.0
+    assert cache.stats()['misses'] == 2
+
+
+@pytest.mark.parametrize('result', [ValueError("portal down"), None, ({}, 1.0)])
+def test_waiters_woken_on_failure(result):
+    fetch = Fetch(result)
+    fetch.gate.clear()
+    cache = AvailabilityCache(fetch)
+    join = get_in_threads(cache, 'SKU-1', 3)
+    wait_for(lambda: cache.stats()['coalesced'] == 2)
+    fetch.gate.set()
+    outcomes = join()
+    assert all(isinstance(outcome, Exception) for outcome in outcomes)
+    assert fetch.calls == 1
+    assert cache.stats()['errors'] == 1 and cache.stats()['entries'] == 0
+
+
+def test_unavailable_answer_isnt_cached():
+    fetch = Fetch(({}, None, False), ({}, 1.0, True))
+    cache = AvailabilityCache(fetch)
+    assert cache.get('SKU-1')[2] is False
+    assert cache.get('SKU-1')[2] is True
+    assert fetch.calls == 2
+
+
+def test_eviction_by_bytes():
+    value = ({'WH01': {'qty': 1}}, 1.0, True)
+    cache = AvailabilityCache(Fetch(value), max_bytes=approximate_size(value) * 2)
+    for catalog_number in ('SKU-1', 'SKU-2'):
+        cache.get(catalog_number)
+    # SKU-1 is the most recently used now
+    cache.get('SKU-1')
+    cache.get('SKU-3')
+    assert list(cache.entries) == ['SKU-1', 'SKU-3']
+    assert cache.stats()['bytes'] == approximate_size(value) * 2
+
+
+def test_stats(clock):
+    cache = AvailabilityCache(Fetch())
+    cache.get('SKU-1')
+    clock.now += 10
+    cache.get('SKU-1')
+    cache.get('SKU-2')
+    clock.now += 5
+    stats = cache.stats()
+    assert stats['hit_rate'] == pytest.approx(1.0 / 3)
+    assert stats['mean_age'] == pytest.approx(10.0)
+    assert stats['max_age'] == pytest.approx(15.0)
+    assert stats['entries'] == 2
+
+
+def test_closed_cache_serves_stale_values(clock):
+    fetch = Fetch()
+    cache = AvailabilityCache(fetch)
+    value = cache.get('SKU-1')
+    cache.close()
+    clock.now += 61
+    assert cache.get('SKU-1') == value
+    assert fetch.calls == 1 and not cache.flights
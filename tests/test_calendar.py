@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""The precomputed lead dates must be the ones next_business_days() gives"""
+import datetime
+
+import pytest
+
+dates = pytest.importorskip('utils.dates')
+scraper = pytest.importorskip('scraper')
+
+# days before the holidays, the lead days run across them and the weekends around
+TODAYS = [
+    datetime.date(2030, 7, 2),
+    datetime.date(2030, 11, 26),
+    datetime.date(2030, 12, 20),
+    datetime.date(2030, 12, 30),
+]
+
+
+def freeze_today(monkeypatch, today):
+    class FrozenDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return cls(today.year, today.month, today.day)
+
+    monkeypatch.setattr(datetime, 'date', FrozenDate)
+    # modules that imported the class itself
+    for module in (dates, scraper):
+        if getattr(module, 'date', None) is not None:
+            monkeypatch.setattr(module, 'date', FrozenDate)
+
+
+@pytest.mark.parametrize('today', TODAYS, ids=str)
+def test_lead_date(monkeypatch, today):
+    freeze_today(monkeypatch, today)
+    # a short horizon, the later lead days are past it
+    calendar = scraper.BusinessCalendar(horizon=5)
+    for lead_days in range(1, 31):
+        assert calendar.lead_date(lead_days) == dates.next_business_days(lead_days)[-1][0], lead_days
+
+
+def test_lead_date_next_day(monkeypatch):
+    freeze_today(monkeypatch, TODAYS[2])
+    calendar = scraper.BusinessCalendar(horizon=10)
+    calendar.lead_date(1)
+    freeze_today(monkeypatch, TODAYS[2] + datetime.timedelta(days=1))
+    for lead_days in range(1, 16):
+        assert calendar.lead_date(lead_days) == dates.next_business_days(lead_days)[-1][0], lead_days
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+
+import pytest
+
+import catalog_cache
+from catalog_cache import CatalogNumberCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(catalog_cache.time, 'time', clock)
+    return clock
+
+
+def test_hit_and_miss(tmpdir):
+    cache = CatalogNumberCache(str(tmpdir.join('cache.sqlite3')))
+    assert cache.get('N1') is None
+    cache.set('N1', 'SKU-1')
+    assert cache.get('N1') == 'SKU-1'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'errors': 0, 'size': 1}
+
+
+def test_survives_reopening(tmpdir):
+    path = str(tmpdir.join('cache.sqlite3'))
+    CatalogNumberCache(path).set('N1', 'SKU-1')
+    assert CatalogNumberCache(path).get('N1') == 'SKU-1'
+
+
+def test_ttl(clock):
+    cache = CatalogNumberCache(':memory:', ttl=60)
+    cache.set('N1', 'SKU-1')
+    clock.now += 59
+    assert cache.get('N1') == 'SKU-1'
+    clock.now += 2
+    assert cache.get('N1') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction(clock):
+    cache = CatalogNumberCache(':memory:', max_size=2, touch_interval=10)
+    cache.set('N1', 'SKU-1')
+    clock.now += 1
+    cache.set('N2', 'SKU-2')
+    clock.now += 20
+    # a use after touch_interval counts for the eviction
+    assert cache.get('N1') == 'SKU-1'
+    clock.now += 1
+    cache.set('N3', 'SKU-3')
+    assert cache.get('N2') is None
+    assert cache.get('N1') == 'SKU-1'
+    assert cache.get('N3') == 'SKU-3'
+    assert cache.stats()['size'] == 2
+
+
+def test_recent_hit_doesnt_write(clock):
+    cache = CatalogNumberCache(':memory:', touch_interval=10)
+    cache.set('N1', 'SKU-1')
+    clock.now += 5
+    before = cache.db.total_changes
+    assert cache.get('N1') == 'SKU-1'
+    assert cache.db.total_changes == before
+    clock.now += 10
+    assert cache.get('N1') == 'SKU-1'
+    assert cache.db.total_changes == before + 1
+
+
+def test_database_errors_are_misses():
+    cache = CatalogNumberCache(':memory:')
+    cache.set('N1', 'SKU-1')
+    cache.db.close()
+    assert cache.get('N1') is None
+    cache.set('N2', 'SKU-2')
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'errors': 2, 'size': None}
+
+
+def test_open_falls_back_to_memory(tmpdir):
+    path = os.path.join(str(tmpdir), 'missing', 'cache.sqlite3')
+    with pytest.raises(sqlite3.Error):
+        CatalogNumberCache(path)
+    cache = CatalogNumberCache.open(path)
+    cache.set('N1', 'SKU-1')
+    assert cache.get('N1') == 'SKU-1'
+    assert not os.path.exists(path)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""The plain HTTP mode against the fake portal, the browser must not be touched"""
+import logging
+
+import pytest
+import requests
+
+import fake_portal
+
+scraper = pytest.importorskip('scraper')
+
+
+class BrowserUsed(Exception):
+    pass
+
+
+class NoBrowser(object):
+    """Any use raises BrowserUsed"""
+
+    def __getattr__(self, name):
+        raise BrowserUsed(name)
+
+
+class HttpScraper(scraper.Scraper):
+    USERNAME = 'test'
+    PASSWORD = 'test'
+    HTTP_MODE = True
+    SESSION_FILE = None
+    CATALOG_CACHE_PATH = ':memory:'
+    ORDER_STATUS_PATH = ':memory:'
+    ORDER_SNAPSHOT_TTL = 0
+    log = logging.getLogger('test_http_mode')
+
+    def __init__(self, domain, session):
+        self.DOMAIN = domain
+        self.browser = NoBrowser()
+        self.http = session
+        self.http_ok = True
+        self.logged_in = True
+
+
+@pytest.fixture
+def portal():
+    """Factory of (server, scraper logged in over plain HTTP)"""
+    servers = []
+
+    def start(**options):
+        server, url = fake_portal.serve(rows=3, **options)
+        servers.append(server)
+        session = requests.Session()
+        session.post(url + '/b2b_altra/b2b/login.do', data={'UserId': 'test', 'nolog_password': 'test'})
+        return server, HttpScraper(url, session)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_get_availability(portal):
+    _, spider = portal(plain_links=True)
+    availability, price, ok = spider.get_availability('SKU-1')
+    assert ok and price == 12.5
+    assert sorted(availability) == ['WH01', 'WH02', 'WH03']
+    assert [availability[location]['qty'] for location in sorted(availability)] == [0, 10, 20]
+    assert spider.http_ok
+
+
+def test_get_availability_bulk(portal):
+    _, spider = portal(plain_links=True)
+    results = spider.get_availability_bulk(['SKU-1', 'SKU-2', 'SKU-1'])
+    assert sorted(results) == ['SKU-1', 'SKU-2']
+    assert all(ok for _, _, ok in results.values())
+    assert spider.http_ok
+
+
+def test_get_tracking(portal):
+    _, spider = portal(plain_links=True)
+    tracking = spider.get_tracking('PO00002')
+    # the catalog numbers are translated back over HTTP as well
+    assert [item['item_id'] for item in tracking] == ['PO00002-1', 'PO00002-2', 'PO00002-3']
+    assert [item['tracking_number'] for item in tracking] == ['1ZPO000020001', '1ZPO000020002', '1ZPO000020003']
+    assert tracking[0]['shipping_method'] == 'UPS'
+    assert spider.http_ok
+
+
+def test_sweep_orders(portal):
+    _, spider = portal(plain_links=True, orders=4)
+    swept = list(spider.sweep_orders())
+    assert [po_number for po_number, _, _ in swept] == ['PO00001', 'PO00002', 'PO00003', 'PO00004']
+    for po_number, _, tracking in swept:
+        assert tracking and all(item['item_id'].startswith(po_number) for item in tracking)
+    # nothing changed since
+    assert list(spider.sweep_orders()) == []
+    assert spider.http_ok
+
+
+def test_sweep_marks_only_the_orders_handed_over(portal):
+    _, spider = portal(plain_links=True, orders=3)
+    sweep = spider.sweep_orders()
+    assert next(sweep)[0] == 'PO00001'
+    # the caller stopped before it was done with PO00001
+    sweep.close()
+    assert [po_number for po_number, _, _ in spider.sweep_orders()] == ['PO00001', 'PO00002', 'PO00003']
+
+
+def test_order_status_index_errors_are_unknown_statuses():
+    index = scraper.OrderStatusIndex(':memory:')
+    index.set('PO00001', 'Open')
+    index.db.close()
+    assert index.get('PO00001') is None
+    index.set('PO00001', 'Completed')
+    assert index.errors == 2
+
+
+def test_expired_session_falls_back_to_browser(portal):
+    _, spider = portal(plain_links=True)
+    spider.http.cookies.clear()
+    with pytest.raises(BrowserUsed):
+        spider.get_availability('SKU-1')
+    assert not spider.http_ok
+
+
+def test_wrong_order_detail_is_rejected(portal, monkeypatch):
+    server, spider = portal(plain_links=True)
+    spider.get_tracking('PO00001')
+    # the link doesn't select the order, the session keeps showing PO00001
+    monkeypatch.setattr(server.RequestHandlerClass, 'document_status',
+                        lambda handler, fields: fake_portal.PAGE % ('Order', '', ''))
+    detail = spider.http_get(spider.ORDER_DETAIL_URL)
+    assert not spider.order_detail_matches(detail, ['4500000002', 'PO00002', 'Completed'])
+    with pytest.raises(BrowserUsed):
+        spider.get_tracking('PO00002')
+    # only this call needed the browser
+    assert spider.http_ok
+
+
+def test_onclick_result_link_keeps_http_mode(portal):
+    _, spider = portal(plain_links=False)
+    with pytest.raises(BrowserUsed):
+        spider.get_tracking('PO00001')
+    assert spider.http_ok
+    assert spider.get_availability('SKU-1')[2]
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""The lxml extraction must read the same texts the WebElement one did"""
+import lxml.html
+import pytest
+
+from conftest import fixture_path
+from html_text import element_text, xpath_attr, xpath_text
+
+# (fixture, rows xpath, cell xpaths read from every row, cell attributes)
+PAGES = [
+    ('help_values.html', "//table[@class='itemlist']//tr",
+     ["./td[2]/a", "./td[7]/a", "./td[9]/a", "./td[11]/a", "./td[14]/a"], []),
+    ('order_detail.html', "//table[@class='itemlist']//tr[contains(@id, 'row_')]",
+     ["./td[@class='product']", "./td[@class='date-on']", "./td[@class='qty']"], []),
+    ('order_detail.html', "//table[@class='itemlist']//tr[contains(@id, 'rowdetail_')]",
+     [], [(".//a[./img[@alt='External Order Tracking']]", 'onclick')]),
+    ('order_simulate.html', "//td[@class='product']/parent::tr",
+     [".//td[@class='product']", ".//td[@class='qty']"], []),
+]
+
+# single elements of the whole page
+PAGE_TEXTS = [
+    ('order_detail.html', "//h1[contains(., 'Order:')]"),
+    ('order_detail.html', ".//td[contains(text(),'Shipping Costs:')]/following-sibling::td[1]"),
+    ('order_simulate.html', "(//div[@class='header-itemdefault']//td[@class='value'])[1]"),
+    ('help_values.html', "//table[@class='itemlist']//tr[1]"),
+]
+
+
+def load(browser, name):
+    from selenium.webdriver.support.ui import WebDriverWait
+    browser.get('file://' + fixture_path(name))
+    WebDriverWait(browser, 10).until(lambda browser: browser.execute_script(
+        "return document.readyState == 'complete' && document.body != null"))
+    return lxml.html.fromstring(browser.page_source)
+
+
+def webelement_value(elem, xpath, attr=None):
+    """Text or attribute the old code read, None where it raised"""
+    from selenium.common.exceptions import NoSuchElementException
+    try:
+        found = elem.find_element_by_xpath(xpath)
+    except NoSuchElementException:
+        return None
+    return found.get_attribute(attr) if attr else found.text
+
+
+def lxml_value(elem, xpath, attr=None):
+    from selenium.common.exceptions import NoSuchElementException
+    try:
+        return xpath_attr(elem, xpath, attr) if attr else xpath_text(elem, xpath)
+    except NoSuchElementException:
+        return None
+
+
+@pytest.mark.parametrize('name,rows_xpath,cells,attrs', PAGES)
+def test_rows_match_webelement(browser, name, rows_xpath, cells, attrs):
+    tree = load(browser, name)
+    rows = tree.xpath(rows_xpath)
+    elements = browser.find_elements_by_xpath(rows_xpath)
+    assert rows and len(rows) == len(elements)
+    for row, element in zip(rows, elements):
+        for xpath in cells:
+            assert lxml_value(row, xpath) == webelement_value(element, xpath), xpath
+        for xpath, attr in attrs:
+            assert lxml_value(row, xpath, attr) == webelement_value(element, xpath, attr), xpath
+
+
+@pytest.mark.parametrize('name,xpath', PAGE_TEXTS)
+def test_page_text_matches_webelement(browser, name, xpath):
+    tree = load(browser, name)
+    assert lxml_value(tree, xpath) == webelement_value(browser, xpath)
+
+
+def test_verify_address_split_matches_webelement(browser):
+    xpath = "(//div[@class='header-itemdefault']//td[@class='value'])[1]"
+    tree = load(browser, 'order_simulate.html')
+    old = [el.strip(' .') for el in browser.find_element_by_xpath(xpath).text.split('...')]
+    assert [el.strip(' .') for el in xpath_text(tree, xpath).split('...')] == old
+
+
+@pytest.mark.parametrize('html,text', [
+    ('<td> a \n b&nbsp;&nbsp;c </td>', 'a b  c'),
+    ('<td>a<script>var b;</script><style>p {}</style>c</td>', 'ac'),
+    ('<td>a<span style="display: none">b</span><span hidden>c</span>d</td>', 'ad'),
+    ('<td>a<!-- b -->c</td>', 'ac'),
+    ('<td>a<br>b</td>', 'a\nb'),
+    ('<div><div>a</div> <div>b</div></div>', 'a\nb'),
+    ('<table><tr><td>a</td><td>b</td></tr><tr><td>c</td></tr></table>', 'a b\nc'),
+])
+def test_element_text(html, text):
+    assert element_text(lxml.html.fragment_fromstring(html)) == text
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""ScraperPool dispatch with a scraper_class that needs no browser"""
+import os
+import time
+
+import pytest
+
+pool = pytest.importorskip('pool')
+
+
+class FakeScraper(object):
+    """Picklable by reference, the workers import it from this module"""
+
+    def __init__(self, **kwargs):
+        self.logged_in = False
+
+    def login(self):
+        self.logged_in = True
+        return True
+
+    def quit_browser(self):
+        self.logged_in = False
+
+    def echo(self, value, delay=0):
+        time.sleep(delay)
+        return value
+
+    def pid(self, delay=0):
+        time.sleep(delay)
+        return os.getpid()
+
+    def fail(self):
+        raise ValueError("failed")
+
+    def die(self):
+        os._exit(1)
+
+
+class NoLoginScraper(FakeScraper):
+    def login(self):
+        return False
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    monkeypatch.setattr(pool, 'RESTART_DELAY', 0.1)
+    pools = []
+
+    def make(size, scraper_class=FakeScraper):
+        pools.append(pool.ScraperPool(size, scraper_class=scraper_class))
+        return pools[-1]
+
+    yield make
+    for scraper_pool in pools:
+        scraper_pool.close(timeout=5)
+
+
+def test_dispatch(make_pool):
+    scraper_pool = make_pool(2)
+    futures = [scraper_pool.submit('pid', delay=0.5) for _ in range(2)]
+    # one job per idle worker
+    assert len(set(future.result(30) for future in futures)) == 2
+    assert [scraper_pool.call('echo', n, timeout=30) for n in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        scraper_pool.call('fail', timeout=30)
+    stats = scraper_pool.stats()
+    assert stats['completed'] == 6 and stats['busy'] == 0 and stats['queue_depth'] == 0
+
+
+def test_cancel_queued_job(make_pool):
+    scraper_pool = make_pool(1)
+    running = scraper_pool.submit('echo', 'first', delay=0.5)
+    queued = scraper_pool.submit('echo', 'second')
+    assert scraper_pool.stats()['queue_depth'] == 1
+    assert queued.cancel()
+    assert running.result(30) == 'first'
+    assert scraper_pool.call('echo', 'third', timeout=30) == 'third'
+    assert queued.cancelled()
+    assert scraper_pool.stats()['completed'] == 2
+
+
+def test_dead_worker_fails_its_job(make_pool):
+    scraper_pool = make_pool(1)
+    with pytest.raises(pool.WebDriverException):
+        scraper_pool.submit('die').result(30)
+    # the job queued meanwhile runs on the restarted worker
+    assert scraper_pool.call('echo', 'after', timeout=30) == 'after'
+
+
+def test_close_times_out_busy_workers(make_pool):
+    scraper_pool = make_pool(1)
+    running = scraper_pool.submit('echo', 'slow', delay=30)
+    queued = scraper_pool.submit('echo', 'queued')
+    started = time.time()
+    scraper_pool.close(timeout=1)
+    assert time.time() - started < 10
+    assert queued.cancelled()
+    with pytest.raises(pool.WebDriverException):
+        running.result(0)
+
+
+def test_failed_login_is_an_error(make_pool):
+    scraper_pool = make_pool(1, NoLoginScraper)
+    with pytest.raises(pool.LoginError):
+        scraper_pool.call('echo', 'not run', timeout=30)